@@ -2,21 +2,23 @@
 
 import tempfile
 import os
-import base64
+import binascii
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Awaitable, Optional, Tuple, Union
 from datetime import datetime
 
+import orjson
+import pybase64
 from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
 from loguru import logger
 
-from app.services.ocr_service import extract_text
+from app.services.ocr_service import extract_text, extract_text_from_bytes
 from app.services.cache_service import cache_service
 from app.services.ai_service import get_ai_service
 from app.schemas import TextExtractionResponse, ExtractionResponse
-from app.utils import calculate_file_hash
+from app.utils import calculate_file_hash, new_file_hasher, safe_unlink, TEMP_DIR
 from app.exceptions import InvalidFileTypeError, FileProcessingError, OcrError, AiServiceError
 
 router = APIRouter()
@@ -29,9 +31,30 @@ SUPPORTED_FILE_TYPES = {
     "image/jpg"
 }
 
+# Stable, pre-built views of the supported types used on every request
+_SUPPORTED_FILE_TYPES_LIST = tuple(sorted(SUPPORTED_FILE_TYPES))
+
+# File extension used for temporary files, by content type
+_MIME_TO_EXT = {
+    "application/pdf": ".pdf",
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg"
+}
+
+# Number of leading bytes inspected to detect the real file type
+SNIFF_BYTES = 16
+
 # Maximum file size (10MB)
 MAX_FILE_SIZE = 10 * 1024 * 1024
 
+# Upper bound on the decoded size estimated from a base64 payload's length;
+# the slack covers data URL prefixes and line breaks, which also count
+MAX_BASE64_DECODED_ESTIMATE = MAX_FILE_SIZE + MAX_FILE_SIZE // 32
+
+# Chunk size used when streaming uploads to disk (1MB)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 class N8NBinaryFile(BaseModel):
     """Model for N8N binary file data"""
@@ -56,6 +79,204 @@ class SimpleN8NRequest(BaseModel):
     mimetype: Optional[str] = "application/pdf"
 
 
+def _decode_base64_payload(base64_data: str) -> bytes:
+    """
+    Decode base64 file data, stripping an optional data URL prefix
+    
+    The prefix (e.g. "data:application/pdf;base64,") is removed with a
+    zero-copy memoryview slice so large payloads are not duplicated.
+    """
+    raw = base64_data.encode('ascii') if isinstance(base64_data, str) else base64_data
+    if raw[:5] == b'data:':
+        comma = raw.find(b',', 5)
+        if comma < 0:
+            raise ValueError("Malformed data URL: missing ',' separator")
+        raw = memoryview(raw)[comma + 1:]
+    
+    try:
+        return pybase64.b64decode(raw, validate=True)
+    except binascii.Error:
+        # Fall back to lenient decoding (e.g. embedded newlines)
+        return pybase64.b64decode(raw)
+
+
+def _sniff_content_type(head: bytes) -> str:
+    """Detect the content type from a file's magic bytes, or return '' if unknown"""
+    if head[:5] == b"%PDF-":
+        return "application/pdf"
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if head[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    return ""
+
+
+async def _spool_upload(file: UploadFile, suffix: str) -> Tuple[str, str, int]:
+    """
+    Stream an uploaded file into a temporary file while hashing it
+    
+    The upload is copied in fixed-size chunks so the whole file is never held
+    in memory, and the SHA-256 digest is computed from the same chunks.
+    
+    Args:
+        file: Uploaded file to spool
+        suffix: File extension for the temporary file
+        
+    Returns:
+        Tuple of (temporary file path, SHA-256 hex digest, file size in bytes)
+        
+    Raises:
+        FileProcessingError: If the file exceeds MAX_FILE_SIZE
+    """
+    hasher = new_file_hasher()
+    file_size = 0
+    
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=TEMP_DIR) as temp_file:
+        temp_file_path = temp_file.name
+        try:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                if file_size > MAX_FILE_SIZE:
+                    raise _file_too_large(f"File size exceeds {MAX_FILE_SIZE} bytes")
+                hasher.update(chunk)
+                temp_file.write(chunk)
+        except BaseException:
+            temp_file.close()
+            os.unlink(temp_file_path)
+            raise
+    
+    return temp_file_path, hasher.hexdigest(), file_size
+
+
+async def _get_cached_response(file_hash: str) -> Optional[Response]:
+    """
+    Look up a cached extraction result by file hash
+    
+    Cached entries are the JSON bytes we serialized ourselves on a cache miss,
+    so a hit is written straight to the client without Pydantic validation or
+    re-serialization.
+    """
+    raw = await cache_service.get_and_touch(file_hash)
+    if not raw:
+        return None
+    return Response(content=raw, media_type="application/json", headers={"X-Cache": "HIT"})
+
+
+async def _cache_result(file_hash: str, response_data: ExtractionResponse) -> None:
+    """Serialize an extraction result to JSON bytes and store it in the cache"""
+    await cache_service.set_bytes(file_hash, orjson.dumps(response_data.model_dump(mode="json")))
+
+
+def _file_too_large(detail: str) -> FileProcessingError:
+    """Build the error returned for files over MAX_FILE_SIZE"""
+    logger.warning(f"File too large: {detail}")
+    return FileProcessingError(
+        message=f"File too large. Maximum size allowed: {MAX_FILE_SIZE // (1024*1024)}MB",
+        detail=detail
+    )
+
+
+def _decode_file_data(base64_data: str) -> bytes:
+    """Decode a base64 file payload and enforce the upload size limit"""
+    # Every 4 base64 characters decode to 3 bytes, so oversized payloads can be
+    # rejected from their length alone, before allocating the decoded buffer
+    estimated_size = (len(base64_data) * 3) >> 2
+    if estimated_size > MAX_BASE64_DECODED_ESTIMATE:
+        raise _file_too_large(f"Estimated decoded size: {estimated_size} bytes")
+    
+    try:
+        file_content = _decode_base64_payload(base64_data)
+    except Exception as e:
+        logger.error(f"Error decoding base64 data: {e}")
+        raise FileProcessingError(
+            message="Invalid base64 data",
+            detail=str(e)
+        )
+    
+    file_size = len(file_content)
+    if file_size > MAX_FILE_SIZE:
+        raise _file_too_large(f"File size: {file_size} bytes")
+    
+    return file_content
+
+
+async def _run_extraction(ocr: Awaitable[str], file_hash: str, filename: str) -> ExtractionResponse:
+    """
+    Await OCR, structure the text with the AI service and cache the result
+    
+    Args:
+        ocr: Pending OCR call producing the extracted text
+        file_hash: Cache key of the processed file
+        filename: Original filename, used for logging
+    """
+    try:
+        # Extract text using OCR service
+        extracted_text = await ocr
+        logger.info(f"Successfully extracted {len(extracted_text)} characters from {filename}")
+        
+        # Process with AI service to get structured data
+        ai_service = get_ai_service()
+        structured_data = await ai_service.get_structured_data(extracted_text)
+        logger.info(f"Successfully processed structured data from {filename}")
+        
+        # Convert InvoiceData to ExtractionResponse format
+        response_data = ExtractionResponse(
+            invoice_number=structured_data.invoice_number,
+            invoice_date=structured_data.invoice_date,
+            due_date=structured_data.due_date,
+            vendor_name=structured_data.vendor_name,
+            vendor_address=structured_data.vendor_address,
+            customer_name=structured_data.customer_name,
+            customer_address=structured_data.customer_address,
+            subtotal=structured_data.subtotal,
+            tax=structured_data.tax,
+            total=structured_data.total,
+            currency=structured_data.currency,
+            items=structured_data.items
+        )
+        
+        # Cache the structured result for future requests
+        await _cache_result(file_hash, response_data)
+        
+        return response_data
+        
+    except (InvalidFileTypeError, FileProcessingError, OcrError, AiServiceError):
+        # Re-raise our custom exceptions - they will be handled by the exception middleware
+        raise
+        
+    except Exception as e:
+        logger.error(f"Unexpected error processing {filename}: {e}")
+        raise OcrError(
+            message="Failed to process file",
+            detail=str(e)
+        )
+
+
+async def _process_invoice_bytes(file_content: bytes, filename: str, content_type: str) -> Union[ExtractionResponse, Response]:
+    """
+    Extract structured data from in-memory file content
+    
+    Shared by the base64 endpoints: hashes the content, serves cached
+    results, and otherwise runs OCR directly on the decoded buffer.
+    """
+    # Calculate file hash for caching
+    file_hash = calculate_file_hash(file_content)
+    logger.info(f"File hash calculated: {file_hash[:8]}... for {filename}")
+    
+    # Check cache first
+    cached_response = await _get_cached_response(file_hash)
+    if cached_response is not None:
+        logger.info(f"Returning cached result for {filename}")
+        return cached_response
+    
+    # Unknown content types are processed as PDF
+    if content_type not in SUPPORTED_FILE_TYPES:
+        content_type = "application/pdf"
+    
+    logger.info(f"Processing file: {filename} ({content_type}) - {len(file_content)} bytes")
+    return await _run_extraction(extract_text_from_bytes(file_content, content_type), file_hash, filename)
+
+
 @router.get("/health")
 async def health_check():
     """Service health check endpoint"""
@@ -100,7 +321,7 @@ async def health_check_detailed():
             "/extract-n8n",
             "/extract-simple"
         ],
-        "supported_file_types": list(SUPPORTED_FILE_TYPES),
+        "supported_file_types": list(_SUPPORTED_FILE_TYPES_LIST),
         "max_file_size_mb": MAX_FILE_SIZE // (1024 * 1024)
     }
 
@@ -108,7 +329,7 @@ async def health_check_detailed():
 @router.post("/extract", response_model=ExtractionResponse)
 async def extract_invoice_text(
     file: UploadFile = File(...)
-) -> ExtractionResponse:
+) -> Union[ExtractionResponse, Response]:
     """
     Extract structured data from an uploaded invoice file (PDF, PNG, JPG)
     
@@ -122,53 +343,31 @@ async def extract_invoice_text(
         HTTPException: If file validation fails or processing errors occur
     """
     
-    # Validate file type - handle N8N sending multipart/form-data as content_type
-    actual_content_type = file.content_type
-    
-    # If N8N sends multipart/form-data, try to detect from filename
-    if actual_content_type == "multipart/form-data" and file.filename:
-        file_ext = file.filename.lower().split('.')[-1] if '.' in file.filename else ''
-        ext_to_mime = {
-            'pdf': 'application/pdf',
-            'png': 'image/png',
-            'jpg': 'image/jpeg',
-            'jpeg': 'image/jpeg'
-        }
-        actual_content_type = ext_to_mime.get(file_ext, actual_content_type)
-        logger.info(f"Detected file type from extension: {actual_content_type}")
+    # Validate file type from its magic bytes - the declared content type is only
+    # a fallback, since N8N sends multipart/form-data and filenames can lie
+    head = await file.read(SNIFF_BYTES)
+    await file.seek(0)
+    actual_content_type = _sniff_content_type(head) or file.content_type
     
     if actual_content_type not in SUPPORTED_FILE_TYPES:
         logger.warning(f"Unsupported file type: {actual_content_type} (original: {file.content_type})")
         raise InvalidFileTypeError(
             file_type=actual_content_type,
-            supported_types=list(SUPPORTED_FILE_TYPES)
+            supported_types=_SUPPORTED_FILE_TYPES_LIST
         )
     
-    # Read file content to check size and calculate hash
+    # The multipart parser already knows the upload size - reject before copying it
+    if file.size is not None and file.size > MAX_FILE_SIZE:
+        raise _file_too_large(f"File size: {file.size} bytes")
+    
+    # Determine file extension based on content type
+    file_extension = _MIME_TO_EXT.get(actual_content_type, "")
+    
+    # Stream the upload into a temporary file, hashing it in the same pass
     try:
-        file_content = await file.read()
-        file_size = len(file_content)
-        
-        if file_size > MAX_FILE_SIZE:
-            logger.warning(f"File too large: {file_size} bytes")
-            raise FileProcessingError(
-                message=f"File too large. Maximum size allowed: {MAX_FILE_SIZE // (1024*1024)}MB",
-                detail=f"File size: {file_size} bytes"
-            )
-        
-        # Calculate file hash for caching
-        file_hash = calculate_file_hash(file_content)
+        temp_file_path, file_hash, file_size = await _spool_upload(file, file_extension)
         logger.info(f"File hash calculated: {file_hash[:8]}... for {file.filename}")
         
-        # Check cache first
-        cached_result = await cache_service.get(file_hash)
-        if cached_result:
-            logger.info(f"Returning cached result for {file.filename}")
-            return ExtractionResponse(**cached_result)
-        
-        # Reset file pointer
-        await file.seek(0)
-        
     except FileProcessingError:
         # Re-raise our custom exceptions
         raise
@@ -179,89 +378,22 @@ async def extract_invoice_text(
             detail=str(e)
         )
     
-    # Create temporary file for processing
-    temp_file_path = None
+    # Check cache first
+    cached_response = await _get_cached_response(file_hash)
+    if cached_response is not None:
+        logger.info(f"Returning cached result for {file.filename}")
+        safe_unlink(temp_file_path)
+        return cached_response
+    
+    logger.info(f"Processing file: {file.filename} ({actual_content_type}) - {file_size} bytes")
     try:
-        # Determine file extension based on content type
-        file_extension = ""
-        if file.content_type == "application/pdf":
-            file_extension = ".pdf"
-        elif file.content_type in ["image/png"]:
-            file_extension = ".png"
-        elif file.content_type in ["image/jpeg", "image/jpg"]:
-            file_extension = ".jpg"
-        
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(
-            delete=False, 
-            suffix=file_extension
-        ) as temp_file:
-            temp_file_path = temp_file.name
-            temp_file.write(file_content)
-        
-        logger.info(f"Processing file: {file.filename} ({file.content_type}) - {file_size} bytes")
-        
-        # Extract text using OCR service
-        extracted_text = await extract_text(temp_file_path)
-        
-        logger.info(f"Successfully extracted {len(extracted_text)} characters from {file.filename}")
-        
-        # Process with AI service to get structured data
-        try:
-            ai_service = get_ai_service()
-            structured_data = await ai_service.get_structured_data(extracted_text)
-            logger.info(f"Successfully processed structured data from {file.filename}")
-            
-            # Convert InvoiceData to ExtractionResponse format
-            response_data = ExtractionResponse(
-                invoice_number=structured_data.invoice_number,
-                invoice_date=structured_data.invoice_date,
-                due_date=structured_data.due_date,
-                vendor_name=structured_data.vendor_name,
-                vendor_address=structured_data.vendor_address,
-                customer_name=structured_data.customer_name,
-                customer_address=structured_data.customer_address,
-                subtotal=structured_data.subtotal,
-                tax=structured_data.tax,
-                total=structured_data.total,
-                currency=structured_data.currency,
-                items=structured_data.items
-            )
-            
-            # Cache the structured result for future requests
-            cache_data = response_data.model_dump()
-            await cache_service.set(file_hash, cache_data)
-            
-            return response_data
-            
-        except AiServiceError:
-            # Re-raise AI service errors - they will be handled by the exception middleware
-            raise
-        
-    except (InvalidFileTypeError, FileProcessingError, OcrError, AiServiceError):
-        # Re-raise our custom exceptions - they will be handled by the exception middleware
-        raise
-        
-    except Exception as e:
-        logger.error(f"Unexpected error processing {file.filename}: {e}")
-        raise OcrError(
-            message="Failed to process file",
-            detail=str(e)
-        )
-        
+        return await _run_extraction(extract_text(temp_file_path), file_hash, file.filename)
     finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-                logger.debug(f"Cleaned up temporary file: {temp_file_path}")
-            except Exception as e:
-                logger.warning(f"Failed to clean up temporary file {temp_file_path}: {e}")
-                logger.warning(f"Failed to clean up temporary file {temp_file_path}: {e}")
+        safe_unlink(temp_file_path)
 
 
 @router.post("/extract-simple", response_model=ExtractionResponse, operation_id="extract_invoice_simple_n8n")
-async def extract_invoice_simple(request: SimpleN8NRequest) -> ExtractionResponse:
+async def extract_invoice_simple(request: SimpleN8NRequest) -> Union[ExtractionResponse, Response]:
     """
     Simplified N8N endpoint for HTTP Request node integration
     
@@ -280,115 +412,15 @@ async def extract_invoice_simple(request: SimpleN8NRequest) -> ExtractionRespons
         logger.warning(f"Unsupported file type: {request.mimetype}")
         raise InvalidFileTypeError(
             file_type=request.mimetype,
-            supported_types=list(SUPPORTED_FILE_TYPES)
-        )
-    
-    # Decode base64 data
-    try:
-        # Remove data URL prefix if present (e.g., "data:application/pdf;base64,")
-        base64_data = request.data
-        if base64_data.startswith('data:'):
-            base64_data = base64_data.split(',', 1)[1]
-        
-        file_content = base64.b64decode(base64_data)
-        file_size = len(file_content)
-        
-        if file_size > MAX_FILE_SIZE:
-            logger.warning(f"File too large: {file_size} bytes")
-            raise FileProcessingError(
-                message=f"File too large. Maximum size allowed: {MAX_FILE_SIZE // (1024*1024)}MB",
-                detail=f"File size: {file_size} bytes"
-            )
-        
-    except Exception as e:
-        logger.error(f"Error decoding base64 data: {e}")
-        raise FileProcessingError(
-            message="Invalid base64 data",
-            detail=str(e)
+            supported_types=_SUPPORTED_FILE_TYPES_LIST
         )
     
-    # Calculate file hash for caching
-    file_hash = calculate_file_hash(file_content)
-    logger.info(f"File hash calculated: {file_hash[:8]}... for {request.filename}")
-    
-    # Check cache first
-    cached_result = await cache_service.get(file_hash)
-    if cached_result:
-        logger.info(f"Returning cached result for {request.filename}")
-        return ExtractionResponse(**cached_result)
-    
-    # Create temporary file for processing
-    temp_file_path = None
-    
-    try:
-        # Determine file extension from mimetype
-        extension = ".pdf"
-        if "png" in request.mimetype:
-            extension = ".png"
-        elif "jpg" in request.mimetype or "jpeg" in request.mimetype:
-            extension = ".jpg"
-        
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as temp_file:
-            temp_file.write(file_content)
-            temp_file_path = temp_file.name
-            
-        logger.info(f"Processing file: {request.filename} ({request.mimetype}) - {file_size} bytes")
-        
-        # Extract text using OCR
-        extracted_text = await extract_text(temp_file_path)
-        logger.info(f"Successfully extracted {len(extracted_text)} characters from {request.filename}")
-        
-        # Process with AI service to get structured data
-        ai_service = get_ai_service()
-        structured_data = await ai_service.get_structured_data(extracted_text)
-        logger.info(f"Successfully processed structured data from {request.filename}")
-        
-        # Convert InvoiceData to ExtractionResponse format
-        response_data = ExtractionResponse(
-            invoice_number=structured_data.invoice_number,
-            invoice_date=structured_data.invoice_date,
-            due_date=structured_data.due_date,
-            vendor_name=structured_data.vendor_name,
-            vendor_address=structured_data.vendor_address,
-            customer_name=structured_data.customer_name,
-            customer_address=structured_data.customer_address,
-            subtotal=structured_data.subtotal,
-            tax=structured_data.tax,
-            total=structured_data.total,
-            currency=structured_data.currency,
-            items=structured_data.items
-        )
-        
-        # Cache the structured result for future requests
-        cache_data = response_data.model_dump()
-        await cache_service.set(file_hash, cache_data)
-        
-        return response_data
-        
-    except (InvalidFileTypeError, FileProcessingError, OcrError, AiServiceError):
-        # Re-raise our custom exceptions - they will be handled by the exception middleware
-        raise
-        
-    except Exception as e:
-        logger.error(f"Unexpected error processing {request.filename}: {e}")
-        raise OcrError(
-            message="Failed to process file",
-            detail=str(e)
-        )
-        
-    finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-                logger.debug(f"Cleaned up temporary file: {temp_file_path}")
-            except Exception as e:
-                logger.warning(f"Failed to clean up temporary file {temp_file_path}: {e}")
+    file_content = _decode_file_data(request.data)
+    return await _process_invoice_bytes(file_content, request.filename, request.mimetype)
 
 
 @router.post("/extract-n8n", response_model=ExtractionResponse)
-async def extract_invoice_n8n(request: N8NRequest) -> ExtractionResponse:
+async def extract_invoice_n8n(request: N8NRequest) -> Union[ExtractionResponse, Response]:
     """
     Extract structured data from N8N binary file format
     
@@ -420,100 +452,5 @@ async def extract_invoice_n8n(request: N8NRequest) -> ExtractionResponse:
             detail="Expected base64 encoded file data in 'file.data' or 'file_base64' field"
         )
     
-    # Decode base64 data
-    try:
-        # Remove data URL prefix if present
-        if base64_data.startswith('data:'):
-            base64_data = base64_data.split(',')[1]
-        
-        file_content = base64.b64decode(base64_data)
-        file_size = len(file_content)
-        
-        if file_size > MAX_FILE_SIZE:
-            logger.warning(f"File too large: {file_size} bytes")
-            raise FileProcessingError(
-                message=f"File too large. Maximum size allowed: {MAX_FILE_SIZE // (1024*1024)}MB",
-                detail=f"File size: {file_size} bytes"
-            )
-        
-    except Exception as e:
-        logger.error(f"Error decoding base64 data: {e}")
-        raise FileProcessingError(
-            message="Invalid base64 data",
-            detail=str(e)
-        )
-    
-    # Calculate file hash for caching
-    file_hash = calculate_file_hash(file_content)
-    logger.info(f"File hash calculated: {file_hash[:8]}... for {filename}")
-    
-    # Check cache first
-    cached_result = await cache_service.get(file_hash)
-    if cached_result:
-        logger.info(f"Returning cached result for {filename}")
-        return ExtractionResponse(**cached_result)
-    
-    # Create temporary file for processing
-    temp_file_path = None
-    
-    try:
-        # Determine file extension from content type
-        extension = ".pdf"
-        if "png" in content_type:
-            extension = ".png"
-        elif "jpg" in content_type or "jpeg" in content_type:
-            extension = ".jpg"
-        
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as temp_file:
-            temp_file.write(file_content)
-            temp_file_path = temp_file.name
-            
-        logger.info(f"Processing file: {filename} ({content_type}) - {file_size} bytes")
-        
-        # Extract text using OCR
-        try:
-            extracted_text = await extract_text(temp_file_path)
-            logger.debug(f"OCR extracted {len(extracted_text)} characters")
-            
-        except OcrError:
-            # Re-raise OCR errors - they will be handled by the exception middleware
-            raise
-        
-        # Process with AI
-        try:
-            ai_service = get_ai_service()
-            response_data = await ai_service.extract_invoice_data(extracted_text)
-            
-            # Cache the result
-            if hasattr(response_data, 'model_dump'):
-                cache_data = response_data.model_dump()
-            else:
-                cache_data = response_data if isinstance(response_data, dict) else response_data.__dict__
-            await cache_service.set(file_hash, cache_data)
-            
-            return response_data
-            
-        except AiServiceError:
-            # Re-raise AI service errors - they will be handled by the exception middleware
-            raise
-        
-    except (FileProcessingError, OcrError, AiServiceError):
-        # Re-raise our custom exceptions
-        raise
-        
-    except Exception as e:
-        logger.error(f"Unexpected error processing {filename}: {e}")
-        raise OcrError(
-            message="Failed to process file",
-            detail=str(e)
-        )
-        
-    finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-                logger.debug(f"Cleaned up temporary file: {temp_file_path}")
-            except Exception as e:
-                logger.warning(f"Failed to clean up temporary file {temp_file_path}: {e}")
\ No newline at end of file
+    file_content = _decode_file_data(base64_data)
+    return await _process_invoice_bytes(file_content, filename, content_type)
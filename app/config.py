@@ -1,7 +1,10 @@
 """Configuration management using Pydantic settings"""
 
+import os
+from typing import Optional
+
 from pydantic_settings import BaseSettings
-from pydantic import ConfigDict
+from pydantic import ConfigDict, Field
 from functools import lru_cache
 
 
@@ -17,10 +20,23 @@ class Settings(BaseSettings):
     redis_host: str = "redis"
     redis_port: int = 6379
     redis_db: int = 0
+    redis_max_connections: int = 64  # Connection pool size per worker
     
     # API Keys
     google_api_key: str = ""
     
+    # AI service
+    gemini_max_concurrency: int = 8  # Max in-flight Gemini API calls
+    gemini_enable_batching: bool = False  # Coalesce concurrent extractions into one Gemini call
+    gemini_batch_size: int = 8  # Max invoices per batched Gemini call
+    gemini_batch_window_ms: int = 50  # How long to wait for more invoices before sending a batch
+    
+    # File processing
+    invoice_tmpdir: Optional[str] = None  # Directory for temporary upload files
+    
+    # OCR
+    ocr_concurrency: int = Field(default_factory=lambda: os.cpu_count() or 1)  # Parallel PDF page workers
+    
     model_config = ConfigDict(
         env_file=".env",
         env_file_encoding="utf-8"
@@ -1,11 +1,15 @@
 """Custom exceptions for the invoice OCR service"""
 
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, Sequence
 
 
 class AppException(Exception):
     """Base exception for all application errors"""
     
+    # Attributes live in slots, so raising one never builds an instance __dict__
+    __slots__ = ("message", "status_code", "detail", "error_code")
+    
     def __init__(self, message: str, status_code: int = 500, detail: Optional[str] = None, error_code: Optional[str] = None):
         self.message = message
         self.status_code = status_code
@@ -17,7 +21,9 @@ class AppException(Exception):
 class InvalidFileTypeError(AppException):
     """Raised when an unsupported file type is uploaded"""
     
-    def __init__(self, file_type: str, supported_types: list[str]):
+    __slots__ = ()
+    
+    def __init__(self, file_type: str, supported_types: Sequence[str]):
         message = f"Invalid file type: {file_type}"
         detail = f"Supported types: {', '.join(supported_types)}"
         super().__init__(message, status_code=400, detail=detail, error_code="INVALID_FILE_TYPE")
@@ -26,6 +32,8 @@ class InvalidFileTypeError(AppException):
 class OcrError(AppException):
     """Raised when OCR processing fails"""
     
+    __slots__ = ()
+    
     def __init__(self, message: str = "OCR processing failed", detail: Optional[str] = None):
         super().__init__(message, status_code=500, detail=detail, error_code="OCR_ERROR")
 
@@ -33,13 +41,23 @@ class OcrError(AppException):
 class AiServiceError(AppException):
     """Raised when AI service fails"""
     
+    __slots__ = ()
+    
     def __init__(self, message: str = "AI service error", detail: Optional[str] = None, status_code: int = 500):
         super().__init__(message, status_code=status_code, detail=detail, error_code="AI_SERVICE_ERROR")
 
 
+class TransientAiServiceError(AiServiceError):
+    """Raised when AI service fails with a retryable error (rate limit, timeout, 5xx)"""
+    
+    __slots__ = ()
+
+
 class CacheError(AppException):
     """Raised when cache operations fail"""
     
+    __slots__ = ()
+    
     def __init__(self, message: str = "Cache operation failed", detail: Optional[str] = None):
         super().__init__(message, status_code=500, detail=detail, error_code="CACHE_ERROR")
 
@@ -47,15 +65,27 @@ class CacheError(AppException):
 class FileProcessingError(AppException):
     """Raised when file processing fails"""
     
+    __slots__ = ()
+    
     def __init__(self, message: str = "File processing failed", detail: Optional[str] = None):
         super().__init__(message, status_code=400, detail=detail, error_code="FILE_PROCESSING_ERROR")
 
 
+CIRCUIT_BREAKER_OPEN_DETAIL = "Circuit breaker is open due to repeated failures. Please try again later."
+
+
+@lru_cache(maxsize=64)
+def _unavailable_message(service_name: str) -> str:
+    """Format the fail-fast message once per service name"""
+    return f"{service_name} is temporarily unavailable"
+
+
 class CircuitBreakerOpenError(AiServiceError):
     """Raised when circuit breaker is open"""
     
+    __slots__ = ()
+    
     def __init__(self, service_name: str = "AI Service"):
-        message = f"{service_name} is temporarily unavailable"
-        detail = "Circuit breaker is open due to repeated failures. Please try again later."
-        super().__init__(message, detail=detail, status_code=503)
+        message = _unavailable_message(service_name)
+        super().__init__(message, detail=CIRCUIT_BREAKER_OPEN_DETAIL, status_code=503)
         self.error_code = "CIRCUIT_BREAKER_OPEN"
\ No newline at end of file
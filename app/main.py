@@ -1,42 +1,67 @@
 """Main FastAPI application"""
 
-import uuid
+from contextlib import asynccontextmanager
 from typing import Any
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
+from starlette.middleware.gzip import GZipMiddleware
 from loguru import logger
 
 from app.api.v1 import endpoints
-from app.exceptions import AppException
+from app.exceptions import AppException, AiServiceError
+from app.middleware import (
+    RequestDecompressionMiddleware,
+    RequestIdMiddleware,
+    RequestSizeLimitMiddleware,
+    api_error_response
+)
 from app.schemas import ApiError
+from app.services.ai_service import get_ai_service
+from app.services.ocr_service import get_ocr_service, shutdown_page_executor
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup and shutdown hooks"""
+    # Load OCR models and the AI client once, before serving traffic
+    await get_ocr_service()
+    ai_service = None
+    try:
+        ai_service = get_ai_service()
+    except AiServiceError as e:
+        # Keep serving health checks; extraction requests will report the error
+        logger.warning(f"AI service not initialized at startup: {e}")
+    yield
+    # Stop the Gemini batch worker and OCR worker processes
+    if ai_service is not None:
+        await ai_service.close()
+    shutdown_page_executor()
+
 
 app = FastAPI(
     title="Invoice OCR & AI Extraction Service",
     description="An API for extracting structured data from invoice files (PDF, PNG, JPG).",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-
-@app.middleware("http")
-async def add_request_id(request: Request, call_next):
-    """Add unique request ID to all requests for logging purposes"""
-    request_id = str(uuid.uuid4())
-    request.state.request_id = request_id
-    
-    # Add request ID to logger context
-    with logger.contextualize(request_id=request_id):
-        response = await call_next(request)
-        response.headers["X-Request-ID"] = request_id
-        return response
+# Compress responses and accept gzip/deflate encoded request bodies
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+app.add_middleware(RequestDecompressionMiddleware)
+# Refuse oversized uploads from their headers, before the body is read
+app.add_middleware(RequestSizeLimitMiddleware)
+# Outermost, so every response carries the request ID
+app.add_middleware(RequestIdMiddleware)
 
 
 @app.exception_handler(AppException)
-async def app_exception_handler(request: Request, exc: AppException) -> JSONResponse:
+async def app_exception_handler(request: Request, exc: AppException) -> Response:
     """Handle custom application exceptions"""
     request_id = getattr(request.state, "request_id", "unknown")
+    request_logger = getattr(request.state, "logger", logger)
     
     # Log the exception with context
-    logger.error(
+    request_logger.error(
         "Application error occurred: {}",
         exc.message,
         extra={
@@ -56,18 +81,16 @@ async def app_exception_handler(request: Request, exc: AppException) -> JSONResp
         detail=exc.detail
     )
     
-    return JSONResponse(
-        status_code=exc.status_code,
-        content=error_response.model_dump(exclude_none=True, mode='json')
-    )
+    return api_error_response(error_response, exc.status_code)
 
 
 @app.exception_handler(HTTPException)
-async def http_exception_handler(request: Request, exc: HTTPException) -> JSONResponse:
+async def http_exception_handler(request: Request, exc: HTTPException) -> Response:
     """Handle FastAPI HTTP exceptions"""
     request_id = getattr(request.state, "request_id", "unknown")
+    request_logger = getattr(request.state, "logger", logger)
     
-    logger.warning(
+    request_logger.warning(
         "HTTP exception: {}",
         exc.detail,
         extra={
@@ -85,19 +108,17 @@ async def http_exception_handler(request: Request, exc: HTTPException) -> JSONRe
         detail=exc.detail
     )
     
-    return JSONResponse(
-        status_code=exc.status_code,
-        content=error_response.model_dump(exclude_none=True, mode='json')
-    )
+    return api_error_response(error_response, exc.status_code)
 
 
 @app.exception_handler(Exception)
-async def general_exception_handler(request: Request, exc: Exception) -> JSONResponse:
+async def general_exception_handler(request: Request, exc: Exception) -> Response:
     """Handle all other unhandled exceptions"""
     request_id = getattr(request.state, "request_id", "unknown")
+    request_logger = getattr(request.state, "logger", logger)
     
     # Log the full exception details
-    logger.error(
+    request_logger.error(
         "Unhandled exception occurred: {}",
         str(exc),
         extra={
@@ -115,10 +136,7 @@ async def general_exception_handler(request: Request, exc: Exception) -> JSONRes
         detail="An unexpected error occurred. Please try again later."
     )
     
-    return JSONResponse(
-        status_code=500,
-        content=error_response.model_dump(exclude_none=True, mode='json')
-    )
+    return api_error_response(error_response, 500)
 
 
 # Include API routers
@@ -0,0 +1,170 @@
+"""ASGI middleware"""
+
+import zlib
+from secrets import token_hex
+
+from loguru import logger
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.schemas import ApiError
+
+# Upper bound for an inflated request body: a 10MB file base64-encoded
+# (~13.4MB) plus JSON overhead
+MAX_DECOMPRESSED_BODY_SIZE = 16 * 1024 * 1024
+
+# Upper bound for the Content-Length of any request: the same cap, since a
+# base64 JSON body is the largest legitimate payload on the wire
+MAX_REQUEST_BODY_SIZE = MAX_DECOMPRESSED_BODY_SIZE
+
+# zlib window bits for each supported Content-Encoding
+_ZLIB_WBITS = {
+    "gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS,
+}
+
+
+def api_error_response(error_response: ApiError, status_code: int) -> Response:
+    """Serialize an ApiError straight to JSON bytes in pydantic's Rust core"""
+    return Response(
+        content=error_response.model_dump_json(exclude_none=True),
+        status_code=status_code,
+        media_type="application/json"
+    )
+
+
+async def _reject(scope: Scope, receive: Receive, send: Send, status_code: int, error: str, detail: str) -> None:
+    """Send an ApiError response without calling the app"""
+    error_response = ApiError(error=error, error_code="INVALID_REQUEST_BODY", detail=detail)
+    await api_error_response(error_response, status_code)(scope, receive, send)
+
+
+class RequestSizeLimitMiddleware:
+    """
+    Reject requests whose declared Content-Length is over the limit
+
+    Runs before any of the body is read, so an oversized upload is refused
+    without being buffered or spooled to disk by the form parser.
+    """
+
+    def __init__(self, app: ASGIApp, max_body_size: int = MAX_REQUEST_BODY_SIZE):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > self.max_body_size:
+            logger.warning(f"Request body of {content_length} bytes exceeds {self.max_body_size} bytes")
+            await _reject(
+                scope, receive, send, 413, "Request body too large",
+                f"Content-Length exceeds {self.max_body_size} bytes"
+            )
+            return
+
+        await self.app(scope, receive, send)
+
+
+class RequestDecompressionMiddleware:
+    """
+    Inflate gzip/deflate encoded request bodies before they reach the app
+
+    Lets N8N clients compress large base64 payloads on the wire. The inflated
+    size is capped so a small compressed body cannot expand without bound.
+    """
+
+    def __init__(self, app: ASGIApp, max_body_size: int = MAX_DECOMPRESSED_BODY_SIZE):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = Headers(scope=scope).get("content-encoding", "").strip().lower()
+        wbits = _ZLIB_WBITS.get(encoding)
+        if wbits is None:
+            await self.app(scope, receive, send)
+            return
+
+        decompressor = zlib.decompressobj(wbits)
+        body = bytearray()
+        more_body = True
+
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                # Client disconnected before the body was complete
+                return
+            more_body = message.get("more_body", False)
+
+            try:
+                body += decompressor.decompress(
+                    message.get("body", b""), self.max_body_size + 1 - len(body)
+                )
+            except zlib.error as e:
+                logger.warning(f"Invalid {encoding} request body: {e}")
+                await _reject(scope, receive, send, 400, "Invalid compressed request body", str(e))
+                return
+
+            if len(body) > self.max_body_size or decompressor.unconsumed_tail:
+                logger.warning(f"Decompressed request body exceeds {self.max_body_size} bytes")
+                await _reject(
+                    scope, receive, send, 413, "Request body too large",
+                    f"Decompressed body exceeds {self.max_body_size} bytes"
+                )
+                return
+
+        headers = MutableHeaders(scope=scope)
+        del headers["content-encoding"]
+        headers["content-length"] = str(len(body))
+
+        body_sent = False
+
+        async def receive_decompressed() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": bytes(body), "more_body": False}
+            return await receive()
+
+        await self.app(scope, receive_decompressed, send)
+
+
+class RequestIdMiddleware:
+    """
+    Tag each HTTP request with a random ID for log correlation
+
+    Stores the ID and a logger bound to it on the request state and echoes
+    the ID in the X-Request-ID response header. Written as plain ASGI so no
+    extra task or stream is created per request.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = token_hex(16)  # 128-bit random hex ID
+        state = scope.setdefault("state", {})
+        state["request_id"] = request_id
+        # Request-scoped logger carrying the request ID
+        state["logger"] = logger.bind(request_id=request_id)
+
+        header = (b"x-request-id", request_id.encode("ascii"))
+
+        async def send_with_request_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                # Append the raw header pair; the app never sets its own request ID
+                message["headers"] = [*message.get("headers", ()), header]
+            await send(message)
+
+        await self.app(scope, receive, send_with_request_id)
@@ -1,13 +1,11 @@
 """Prompt templates for AI service"""
 
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Sequence, Tuple
 
+import orjson
 
-INVOICE_EXTRACTION_PROMPT = """
-You are an expert at extracting structured data from invoice text. 
-Please extract the following information from the given invoice text and return it in JSON format:
 
-- invoice_number: The invoice or document number
+INVOICE_FIELDS = """- invoice_number: The invoice or document number
 - invoice_date: Date of the invoice (format: YYYY-MM-DD)
 - due_date: Payment due date (format: YYYY-MM-DD)  
 - vendor_name: Name of the vendor/supplier
@@ -19,7 +17,13 @@ Please extract the following information from the given invoice text and return
 - total: Total amount (numeric)
 - currency: Currency code (e.g., USD, EUR)
 - items: Array of line items with description, quantity, unit_price, total_price
+"""
+
+INVOICE_EXTRACTION_PROMPT = """
+You are an expert at extracting structured data from invoice text. 
+Please extract the following information from the given invoice text and return it in JSON format:
 
+""" + INVOICE_FIELDS + """
 If any field is not found or unclear, return null for that field.
 
 Invoice Text:
@@ -30,10 +34,36 @@ Invoice Text:
 Response (valid JSON only):
 """
 
+BATCH_INVOICE_EXTRACTION_PROMPT = """
+You are an expert at extracting structured data from invoice text. 
+You are given a JSON array of invoices, each with an "id", its "text" and optional "tables".
+Please extract the following information from every invoice:
+
+""" + INVOICE_FIELDS + """
+If any field is not found or unclear, return null for that field.
+
+Return a JSON array with exactly one object per input invoice, in the form
+{"id": "<the invoice id>", "invoice": {<extracted fields>}}
+
+Invoices:
+{invoices}
+
+Response (valid JSON only):
+"""
+
+# Literal chunks around the two placeholders, split once at import so
+# building a prompt is plain concatenation instead of a str.format parse
+_PROMPT_PREFIX, _PROMPT_REST = INVOICE_EXTRACTION_PROMPT.split("{invoice_text}", 1)
+_PROMPT_MIDDLE, _PROMPT_SUFFIX = _PROMPT_REST.split("{table_data}", 1)
+_BATCH_PROMPT_PREFIX, _BATCH_PROMPT_SUFFIX = BATCH_INVOICE_EXTRACTION_PROMPT.split("{invoices}", 1)
+
 
 class PromptManager:
     """Manages prompt templates for AI service"""
     
+    # Bump whenever the prompt changes so cached AI responses are not reused
+    PROMPT_VERSION = "v1"
+    
     def __init__(self):
         self.base_template = INVOICE_EXTRACTION_PROMPT
     
@@ -55,11 +85,32 @@ class PromptManager:
         # Format table data if provided
         table_section = ""
         if table_data and table_data.get("tables"):
-            table_section = "\nTable Data:\n"
-            for i, table in enumerate(table_data["tables"]):
-                table_section += f"Table {i+1}:\n{table}\n"
+            table_section = "\nTable Data:\n" + "".join(
+                f"Table {i}:\n{table}\n"
+                for i, table in enumerate(table_data["tables"], 1)
+            )
+        
+        return f"{_PROMPT_PREFIX}{invoice_text}{_PROMPT_MIDDLE}{table_section}{_PROMPT_SUFFIX}"
+    
+    def get_batch_extraction_prompt(
+        self,
+        invoices: Sequence[Tuple[str, str, Optional[Dict[str, Any]]]]
+    ) -> str:
+        """
+        Creates a single prompt extracting several invoices at once
+        
+        Args:
+            invoices: (id, invoice_text, table_data) for each invoice
+            
+        Returns:
+            Prompt asking for a JSON array of {"id", "invoice"} objects
+        """
+        entries = []
+        for invoice_id, invoice_text, table_data in invoices:
+            entry = {"id": invoice_id, "text": invoice_text}
+            if table_data and table_data.get("tables"):
+                entry["tables"] = table_data["tables"]
+            entries.append(entry)
         
-        return self.base_template.format(
-            invoice_text=invoice_text,
-            table_data=table_section
-        )
\ No newline at end of file
+        invoices_json = orjson.dumps(entries).decode()
+        return f"{_BATCH_PROMPT_PREFIX}{invoices_json}{_BATCH_PROMPT_SUFFIX}"
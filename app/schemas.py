@@ -1,8 +1,36 @@
 """Pydantic models for data validation"""
 
-from pydantic import BaseModel, Field
-from typing import Optional, List
-from datetime import date, datetime
+import time
+from pydantic import BaseModel, Field, BeforeValidator, PlainSerializer
+from typing import Annotated, Any, Optional, List
+from datetime import date, datetime, timedelta, timezone
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _timestamp_from_input(value: Any) -> Any:
+    """Accept datetimes and ISO strings so serialized responses round-trip"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.astimezone()
+        return (value - _EPOCH) // timedelta(microseconds=1) * 1000
+    return value
+
+
+def _timestamp_to_iso(value: int) -> str:
+    """Convert nanoseconds since the epoch to an ISO 8601 UTC string"""
+    return (_EPOCH + timedelta(microseconds=value // 1000)).isoformat()
+
+
+# Captured cheaply as an integer; only converted to a datetime when serialized
+Timestamp = Annotated[
+    int,
+    BeforeValidator(_timestamp_from_input),
+    PlainSerializer(_timestamp_to_iso, return_type=str)
+]
 
 
 class ApiError(BaseModel):
@@ -11,14 +39,14 @@ class ApiError(BaseModel):
     error: str
     error_code: Optional[str] = None
     detail: Optional[str] = None
-    timestamp: datetime = Field(default_factory=datetime.now)
+    timestamp: Timestamp = Field(default_factory=time.time_ns)
 
 
 class ApiSuccess(BaseModel):
     """Standard success response wrapper"""
     success: bool = True
     data: dict
-    timestamp: datetime = Field(default_factory=datetime.now)
+    timestamp: Timestamp = Field(default_factory=time.time_ns)
 
 
 class TextExtractionResponse(BaseModel):
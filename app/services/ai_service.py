@@ -1,18 +1,36 @@
 """Gemini AI service with retry and circuit breaker patterns"""
 
-import json
+import asyncio
+import hashlib
 import re
 import time
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Set, Tuple
+from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception_type
 from loguru import logger
+import orjson
+from pydantic import ValidationError
 import google.generativeai as genai
 
 from app.config import settings
-from app.exceptions import AiServiceError, CircuitBreakerOpenError
+from app.exceptions import AiServiceError, CircuitBreakerOpenError, TransientAiServiceError
 from app.prompts.invoice_prompts import PromptManager
 from app.schemas import InvoiceData
+from app.services.cache_service import cache_service
+
+# Gemini model used for invoice extraction
+GEMINI_MODEL_NAME = "gemini-2.5-pro"
+
+# Error message fragments that mark a Gemini failure as transient (retryable)
+TRANSIENT_ERROR_INDICATORS = (
+    "503", "502", "504", "500",  # Server errors
+    "429",  # Rate limit
+    "rate limit",
+    "timeout",
+    "connection",
+    "network",
+    "quota exceeded"
+)
+_TRANSIENT_ERROR_RE = re.compile("|".join(map(re.escape, TRANSIENT_ERROR_INDICATORS)), re.IGNORECASE)
 
 
 class CircuitBreaker:
@@ -21,13 +39,16 @@ class CircuitBreaker:
     def __init__(self, 
                  failure_threshold: int = 5,
                  timeout: int = 60,
-                 expected_exception: type = Exception):
+                 expected_exception: type = Exception,
+                 now: Callable[[], float] = time.monotonic):
         self.failure_threshold = failure_threshold
         self.timeout = timeout
         self.expected_exception = expected_exception
+        self._now = now  # Monotonic clock, injectable for tests
         self.failure_count = 0
-        self.last_failure_time: Optional[datetime] = None
+        self.last_failure_time: Optional[float] = None  # self._now() of the last failure
         self.state = "CLOSED"  # CLOSED, OPEN, HALF_OPEN
+        self._probe_in_flight = False  # A HALF_OPEN trial call is running
     
     async def call(self, func, *args, **kwargs):
         """Execute function with circuit breaker protection"""
@@ -39,6 +60,15 @@ class CircuitBreaker:
                 logger.warning("Circuit breaker is OPEN, failing fast")
                 raise CircuitBreakerOpenError("AI Service")
         
+        # Let a single trial call through while HALF_OPEN; check-and-set needs
+        # no lock as there is no await in between
+        probing = self.state == "HALF_OPEN"
+        if probing:
+            if self._probe_in_flight:
+                logger.warning("Circuit breaker is HALF_OPEN with a trial call running, failing fast")
+                raise CircuitBreakerOpenError("AI Service")
+            self._probe_in_flight = True
+        
         try:
             # Handle both sync and async functions
             result = func(*args, **kwargs)
@@ -49,12 +79,15 @@ class CircuitBreaker:
         except self.expected_exception as e:
             self._on_failure()
             raise e
+        finally:
+            if probing:
+                self._probe_in_flight = False
     
     def _should_attempt_reset(self) -> bool:
         """Check if enough time has passed to attempt reset"""
         if self.last_failure_time is None:
             return True
-        return datetime.now() - self.last_failure_time > timedelta(seconds=self.timeout)
+        return self._now() - self.last_failure_time > self.timeout
     
     def _on_success(self):
         """Reset circuit breaker on successful call"""
@@ -66,13 +99,126 @@ class CircuitBreaker:
     def _on_failure(self):
         """Handle failure in circuit breaker"""
         self.failure_count += 1
-        self.last_failure_time = datetime.now()
+        self.last_failure_time = self._now()
         
         if self.failure_count >= self.failure_threshold:
             self.state = "OPEN"
             logger.error(f"Circuit breaker opened after {self.failure_count} failures")
 
 
+class BatchingGeminiClient:
+    """
+    Coalesce concurrent invoice extractions into batched Gemini calls
+    
+    Requests arriving within a short window are sent as one prompt holding a
+    JSON array of invoices, and each caller gets back the JSON for its own
+    invoice. This amortizes per-request network and auth overhead across the batch.
+    """
+    
+    def __init__(self,
+                 call: Callable[[str], Awaitable[str]],
+                 prompt_manager: PromptManager,
+                 batch_size: int = 8,
+                 window: float = 0.05):
+        self.call = call
+        self.prompt_manager = prompt_manager
+        self.batch_size = batch_size
+        self.window = window
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._dispatches: Set[asyncio.Task] = set()
+    
+    async def extract(self, text: str, table_data: Optional[Dict[str, Any]] = None) -> str:
+        """Queue an invoice for the next batch and return its raw JSON response"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._collect_batches())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, table_data, future))
+        return await future
+    
+    async def _collect_batches(self):
+        """Drain the queue into batches of up to batch_size within the window"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Send without blocking collection of the next batch
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+    
+    async def close(self):
+        """Stop the batch collector and wait for in-flight batches"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._dispatches:
+            await asyncio.gather(*self._dispatches, return_exceptions=True)
+    
+    async def _dispatch(self, batch: List[Tuple[str, Optional[Dict[str, Any]], asyncio.Future]]):
+        """Send one batch to Gemini and fan the results back to the callers"""
+        try:
+            if len(batch) == 1:
+                # Nothing to coalesce - use the regular single-invoice prompt
+                text, table_data, _ = batch[0]
+                prompt = self.prompt_manager.get_extraction_prompt(text, table_data)
+                results = {"0": await self.call(prompt)}
+            else:
+                logger.info(f"Sending batch of {len(batch)} invoices to Gemini")
+                prompt = self.prompt_manager.get_batch_extraction_prompt(
+                    [(str(i), text, table_data) for i, (text, table_data, _) in enumerate(batch)]
+                )
+                results = self._split_batch_response(await self.call(prompt))
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for i, (_, _, future) in enumerate(batch):
+            if future.done():
+                continue
+            result = results.get(str(i))
+            if result is None:
+                future.set_exception(AiServiceError("Batched AI response is missing an invoice"))
+            else:
+                future.set_result(result)
+    
+    @staticmethod
+    def _split_batch_response(response_text: str) -> Dict[str, str]:
+        """Map invoice id to its JSON text from a batched Gemini response"""
+        try:
+            items = orjson.loads(clean_ai_response(response_text))
+        except orjson.JSONDecodeError as e:
+            raise AiServiceError(
+                "Failed to parse structured data from AI response",
+                detail=f"JSON parse error: {str(e)}"
+            )
+        if not isinstance(items, list):
+            raise AiServiceError("Batched AI response is not a JSON array")
+        
+        return {
+            str(item["id"]): orjson.dumps(item["invoice"]).decode()
+            for item in items
+            if isinstance(item, dict) and "id" in item and isinstance(item.get("invoice"), dict)
+        }
+
+
 def clean_ai_response(response_text: str) -> str:
     """
     Clean AI response by removing markdown code blocks and extra whitespace
@@ -86,13 +232,19 @@ def clean_ai_response(response_text: str) -> str:
     # Remove leading/trailing whitespace
     cleaned_text = response_text.strip()
     
-    # Remove markdown code blocks if present
-    # Pattern matches: ```json ... ``` or ```... ```
-    markdown_pattern = r'```(?:json)?\s*(.*?)\s*```'
-    match = re.search(markdown_pattern, cleaned_text, re.DOTALL)
+    # Fast path: plain JSON without markdown fences
+    if "```" not in cleaned_text:
+        return cleaned_text
+    
+    # Remove markdown code blocks if present: ```json ... ``` or ```... ```
+    # The first fenced block is located with two partitions - no regex backtracking
+    _, _, fenced = cleaned_text.partition("```")
+    if fenced.startswith("json"):
+        fenced = fenced[4:]
+    block, closing_fence, _ = fenced.partition("```")
     
-    if match:
-        cleaned_text = match.group(1).strip()
+    if closing_fence:
+        cleaned_text = block.strip()
         logger.debug("Removed markdown code blocks from AI response")
     
     return cleaned_text
@@ -107,7 +259,11 @@ class AIService:
             raise AiServiceError("Google API key not configured")
         
         genai.configure(api_key=settings.google_api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-pro')
+        # JSON mode: Gemini returns bare JSON instead of prose or markdown fences
+        self.model = genai.GenerativeModel(
+            GEMINI_MODEL_NAME,
+            generation_config={"response_mime_type": "application/json"}
+        )
         
         # Initialize circuit breaker
         self.circuit_breaker = CircuitBreaker(
@@ -118,11 +274,26 @@ class AIService:
         
         # Initialize prompt manager
         self.prompt_manager = PromptManager()
+        
+        # Cap concurrent Gemini calls so request bursts don't trigger rate limiting
+        self._gemini_semaphore = asyncio.Semaphore(settings.gemini_max_concurrency)
+        
+        # Optionally coalesce concurrent extractions into batched Gemini calls
+        self._batcher: Optional[BatchingGeminiClient] = None
+        if settings.gemini_enable_batching:
+            self._batcher = BatchingGeminiClient(
+                self._call_with_circuit_breaker,
+                self.prompt_manager,
+                batch_size=settings.gemini_batch_size,
+                window=settings.gemini_batch_window_ms / 1000
+            )
     
     @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=4, max=10),
-        retry=retry_if_exception_type((AiServiceError,)),
+        stop=stop_after_attempt(6),
+        # Full jitter so concurrent requests failing together don't retry in lockstep:
+        # each wait is uniform over [0, 2s], [0, 4s], ... doubling up to the 30s cap
+        wait=wait_random_exponential(multiplier=2, max=30),
+        retry=retry_if_exception_type((TransientAiServiceError,)),
         reraise=True
     )
     async def _call_gemini_api(self, prompt: str) -> str:
@@ -130,7 +301,9 @@ class AIService:
         try:
             logger.info("Calling Gemini API for invoice extraction")
             
-            response = self.model.generate_content(prompt)
+            # The SDK call is blocking - run it in a worker thread to keep the event loop free
+            async with self._gemini_semaphore:
+                response = await asyncio.to_thread(self.model.generate_content, prompt)
             
             if not response.text:
                 raise AiServiceError("Empty response from Gemini API")
@@ -140,61 +313,72 @@ class AIService:
             
         except Exception as e:
             logger.error(f"Gemini API call failed: {str(e)}")
-            # Determine if this is a transient error that should be retried
+            # Only transient errors are retried - permanent ones fail immediately
             if self._is_transient_error(e):
-                raise AiServiceError(f"Transient error from Gemini API: {str(e)}")
+                raise TransientAiServiceError(f"Transient error from Gemini API: {str(e)}")
             else:
                 raise AiServiceError(f"Permanent error from Gemini API: {str(e)}")
     
+    async def _call_with_circuit_breaker(self, prompt: str) -> str:
+        """Call Gemini through the circuit breaker"""
+        return await self.circuit_breaker.call(self._call_gemini_api, prompt)
+    
+    def _response_cache_key(self, prefix: str, text: str, table_data: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Build a content-addressed cache key for an AI extraction
+        
+        Hashes the prompt version, model name, invoice text and table data,
+        each length-prefixed so different inputs cannot collide by concatenation.
+        """
+        parts = (
+            PromptManager.PROMPT_VERSION.encode(),
+            GEMINI_MODEL_NAME.encode(),
+            text.encode(),
+            orjson.dumps(table_data or {}, option=orjson.OPT_SORT_KEYS),
+        )
+        digest = hashlib.sha256(b"".join(len(part).to_bytes(8, "big") + part for part in parts))
+        return f"{prefix}:{digest.hexdigest()}"
+    
     def _is_transient_error(self, error: Exception) -> bool:
         """Determine if error is transient and should be retried"""
-        error_str = str(error).lower()
-        transient_indicators = [
-            "503", "502", "504", "500",  # Server errors
-            "429",  # Rate limit
-            "timeout",
-            "connection",
-            "network",
-            "quota exceeded"
-        ]
-        return any(indicator in error_str for indicator in transient_indicators)
+        return _TRANSIENT_ERROR_RE.search(str(error)) is not None
     
-    async def extract_invoice_data(self, invoice_text: str) -> Dict[str, Any]:
-        """Extract structured data from invoice text"""
-        if not invoice_text or not invoice_text.strip():
-            raise AiServiceError("Empty or invalid invoice text provided")
+    async def _generate_json(self, text: str, table_data: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Send invoice text to Gemini and return the cleaned JSON response text
         
-        prompt = self.prompt_manager.get_extraction_prompt(invoice_text)
+        Shared by extract_invoice_data and get_structured_data: builds the
+        prompt (or queues the invoice for a batch), calls Gemini through the
+        circuit breaker and strips any markdown around the JSON.
         
+        Raises:
+            AiServiceError: If the call fails or the response is empty
+        """
         try:
-            # Use circuit breaker to protect against cascading failures
-            response_text = await self.circuit_breaker.call(
-                self._call_gemini_api, 
-                prompt
-            )
+            if self._batcher is not None:
+                # The batcher builds the prompt and applies the circuit breaker per batch
+                response_text = await self._batcher.extract(text, table_data)
+            else:
+                # Get structured prompt from PromptManager
+                prompt = self.prompt_manager.get_extraction_prompt(text, table_data)
+                logger.debug("Generated prompt length: {} characters", len(prompt))
+                
+                # Use circuit breaker to protect against cascading failures
+                response_text = await self.circuit_breaker.call(
+                    self._call_gemini_api, 
+                    prompt
+                )
             
             # Check for empty response
             if not response_text or not response_text.strip():
                 raise AiServiceError("Empty response from AI service")
             
             # Debug: Log raw AI response
-            logger.debug(f"Raw AI response: {response_text}")
-            
-            # Clean and parse JSON response
-            try:
-                cleaned_response = clean_ai_response(response_text)
-                logger.debug(f"Cleaned AI response: {cleaned_response}")
-                extracted_data = json.loads(cleaned_response)
-                logger.info("Successfully parsed invoice data from AI response")
-                return extracted_data
+            logger.debug("Raw AI response: {}", response_text)
             
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse JSON from AI response: {e}")
-                logger.debug(f"Raw AI response: {response_text}")
-                raise AiServiceError(
-                    "Failed to parse structured data from AI response",
-                    detail=f"JSON parse error: {str(e)}"
-                )
+            cleaned_response = clean_ai_response(response_text)
+            logger.debug("Cleaned AI response: {}", cleaned_response)
+            return cleaned_response
                 
         except CircuitBreakerOpenError:
             # Re-raise circuit breaker errors without modification
@@ -208,6 +392,38 @@ class AIService:
             logger.error(f"Unexpected error in AI service: {e}")
             raise AiServiceError(f"Unexpected error: {str(e)}")
     
+    @staticmethod
+    def _json_parse_error(error: Exception, response_json: str) -> AiServiceError:
+        """Log an unparseable AI response and wrap the error"""
+        logger.error(f"Failed to parse JSON from AI response: {error}")
+        logger.debug("Raw AI response: {}", response_json)
+        return AiServiceError(
+            "Failed to parse structured data from AI response",
+            detail=f"JSON parse error: {str(error)}"
+        )
+    
+    async def extract_invoice_data(self, invoice_text: str) -> Dict[str, Any]:
+        """Extract structured data from invoice text"""
+        if not invoice_text or not invoice_text.strip():
+            raise AiServiceError("Empty or invalid invoice text provided")
+        
+        # Identical OCR text was already extracted - skip the Gemini call
+        cache_key = self._response_cache_key("inv:raw", invoice_text)
+        cached_data = await cache_service.get(cache_key)
+        if cached_data is not None:
+            logger.info("Returning cached AI extraction result")
+            return cached_data
+        
+        response_json = await self._generate_json(invoice_text)
+        try:
+            extracted_data = orjson.loads(response_json)
+        except orjson.JSONDecodeError as e:
+            raise self._json_parse_error(e, response_json)
+        
+        logger.info("Successfully parsed invoice data from AI response")
+        await cache_service.set(cache_key, extracted_data)
+        return extracted_data
+    
     async def get_structured_data(self, text: str, table_data: Optional[Dict[str, Any]] = None) -> InvoiceData:
         """
         Extract structured data from invoice text using Gemini AI
@@ -225,66 +441,45 @@ class AIService:
         if not text or not text.strip():
             raise AiServiceError("Empty or invalid invoice text provided")
         
-        # Debug: Log the OCR text we received
-        logger.debug(f"OCR extracted text (first 500 chars): {text[:500]}")
+        # Debug: Log the OCR text we received - loguru only formats the
+        # arguments when DEBUG is enabled, so large strings cost nothing otherwise
+        logger.debug("OCR extracted text (first 500 chars): {:.500}", text)
+        
+        # Identical OCR text was already extracted - skip the Gemini call
+        cache_key = self._response_cache_key("inv", text, table_data)
+        cached_data = await cache_service.get(cache_key)
+        if cached_data is not None:
+            try:
+                validated_data = InvoiceData.model_validate(cached_data)
+                logger.info("Returning cached AI extraction result")
+                return validated_data
+            except ValidationError as e:
+                # Stale entry from an older schema - drop it and extract again
+                logger.warning(f"Evicting invalid cached AI result: {e}")
+                await cache_service.delete(cache_key)
         
-        # Get structured prompt from PromptManager
-        prompt = self.prompt_manager.get_extraction_prompt(text, table_data)
-        logger.debug(f"Generated prompt length: {len(prompt)} characters")
+        response_json = await self._generate_json(text, table_data)
         
+        # Parse and validate against InvoiceData schema in a single pass
         try:
-            # Use circuit breaker to protect against cascading failures
-            response_text = await self.circuit_breaker.call(
-                self._call_gemini_api, 
-                prompt
+            validated_data = InvoiceData.model_validate_json(response_json)
+        except ValidationError as validation_error:
+            if any(error["type"] == "json_invalid" for error in validation_error.errors()):
+                raise self._json_parse_error(validation_error, response_json)
+            logger.error(f"Data validation failed: {validation_error}")
+            raise AiServiceError(
+                "AI response data failed validation",
+                detail=f"Validation error: {str(validation_error)}"
             )
-            
-            # Check for empty response
-            if not response_text or not response_text.strip():
-                raise AiServiceError("Empty response from AI service")
-            
-            # Debug: Log raw AI response
-            logger.debug(f"Raw AI response: {response_text}")
-            
-            # Clean and parse JSON response
-            try:
-                cleaned_response = clean_ai_response(response_text)
-                logger.debug(f"Cleaned AI response: {cleaned_response}")
-                extracted_data = json.loads(cleaned_response)
-                logger.info("Successfully parsed invoice data from AI response")
-                
-                # Validate against InvoiceData schema
-                try:
-                    validated_data = InvoiceData(**extracted_data)
-                    logger.info("Successfully validated invoice data against schema")
-                    return validated_data
-                    
-                except Exception as validation_error:
-                    logger.error(f"Data validation failed: {validation_error}")
-                    raise AiServiceError(
-                        "AI response data failed validation",
-                        detail=f"Validation error: {str(validation_error)}"
-                    )
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse JSON from AI response: {e}")
-                logger.debug(f"Raw AI response: {response_text}")
-                raise AiServiceError(
-                    "Failed to parse structured data from AI response",
-                    detail=f"JSON parse error: {str(e)}"
-                )
-                
-        except CircuitBreakerOpenError:
-            # Re-raise circuit breaker errors without modification
-            raise
         
-        except AiServiceError:
-            # Re-raise AI service errors without modification
-            raise
-        
-        except Exception as e:
-            logger.error(f"Unexpected error in AI service: {e}")
-            raise AiServiceError(f"Unexpected error: {str(e)}")
+        logger.info("Successfully validated invoice data against schema")
+        await cache_service.set(cache_key, validated_data.model_dump(mode="json"))
+        return validated_data
+    
+    async def close(self):
+        """Release background resources held by the service"""
+        if self._batcher is not None:
+            await self._batcher.close()
     
     # Placeholder for fallback logic to other AI providers
     def _fallback_to_openai(self, text: str) -> InvoiceData:
@@ -1,42 +1,54 @@
 """Redis cache service"""
 
-from typing import Optional, Any
-import json
+from typing import Optional, Any, List
+import asyncio
+import orjson
 import redis.asyncio as redis
 from loguru import logger
 
 from app.config import settings
 from app.exceptions import CacheError
 
+# Cache entry time-to-live: 24 hours
+CACHE_TTL_SECONDS = 86400
+
 
 class CacheService:
     """Redis cache service for storing invoice processing results"""
     
     def __init__(self):
         self._redis_client: Optional[redis.Redis] = None
+        self._init_lock = asyncio.Lock()
     
     async def _get_client(self) -> redis.Redis:
         """Get or create Redis client connection with connection pooling"""
         if self._redis_client is None:
-            try:
-                self._redis_client = redis.Redis(
-                    host=settings.redis_host,
-                    port=settings.redis_port,
-                    db=settings.redis_db,
-                    decode_responses=True,
-                    max_connections=10,  # Connection pool for better resource management
-                    socket_connect_timeout=5,  # Prevent hanging connections
-                    socket_timeout=5,
-                    retry_on_timeout=True
-                )
-                # Test connection
-                await self._redis_client.ping()
-                logger.info(f"Connected to Redis at {settings.redis_host}:{settings.redis_port}")
-            except Exception as e:
-                logger.error(f"Failed to connect to Redis: {e}")
-                raise CacheError(f"Redis connection failed: {e}")
+            # Concurrent first requests must not each build a pool and ping
+            async with self._init_lock:
+                if self._redis_client is None:
+                    await self._connect()
         return self._redis_client
     
+    async def _connect(self) -> None:
+        """Create the Redis client and verify the connection"""
+        try:
+            self._redis_client = redis.Redis(
+                host=settings.redis_host,
+                port=settings.redis_port,
+                db=settings.redis_db,
+                decode_responses=False,  # Values are returned as raw bytes
+                max_connections=settings.redis_max_connections,  # Shared connection pool size
+                socket_connect_timeout=5,  # Prevent hanging connections
+                socket_timeout=5,
+                retry_on_timeout=True
+            )
+            # Test connection
+            await self._redis_client.ping()
+            logger.info(f"Connected to Redis at {settings.redis_host}:{settings.redis_port}")
+        except Exception as e:
+            logger.error(f"Failed to connect to Redis: {e}")
+            raise CacheError(f"Redis connection failed: {e}")
+    
     async def get(self, key: str) -> Optional[dict]:
         """Get value from cache by key"""
         try:
@@ -44,7 +56,7 @@ class CacheService:
             value = await client.get(key)
             if value:
                 logger.info(f"Cache hit for key: {key[:8]}...")
-                return json.loads(value)
+                return orjson.loads(value)
             logger.info(f"Cache miss for key: {key[:8]}...")
             return None
         except Exception as e:
@@ -55,8 +67,7 @@ class CacheService:
         """Set value in cache with 24-hour TTL"""
         try:
             client = await self._get_client()
-            json_value = json.dumps(value)
-            result = await client.setex(key, 86400, json_value)  # 24 hours = 86400 seconds
+            result = await client.setex(key, CACHE_TTL_SECONDS, orjson.dumps(value))
             if result:
                 logger.info(f"Cache set for key: {key[:8]}...")
                 return True
@@ -65,8 +76,69 @@ class CacheService:
             logger.error(f"Redis set error for key {key[:8]}...: {e}")
             return False
     
+    async def get_and_touch(self, key: str) -> Optional[bytes]:
+        """
+        Get raw serialized value and refresh its TTL in a single round-trip
+        
+        GET and EXPIRE are sent together in one non-transactional pipeline, so
+        frequently requested entries stay cached without an extra call.
+        """
+        try:
+            client = await self._get_client()
+            pipe = client.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.expire(key, CACHE_TTL_SECONDS)
+            value, _ = await pipe.execute()
+            if value:
+                logger.info(f"Cache hit for key: {key[:8]}...")
+                return value
+            logger.info(f"Cache miss for key: {key[:8]}...")
+            return None
+        except Exception as e:
+            logger.error(f"Redis get error for key {key[:8]}...: {e}")
+            return None
+    
+    async def set_bytes(self, key: str, value: bytes) -> bool:
+        """Set pre-serialized value in cache with 24-hour TTL"""
+        try:
+            client = await self._get_client()
+            result = await client.setex(key, CACHE_TTL_SECONDS, value)
+            if result:
+                logger.info(f"Cache set for key: {key[:8]}...")
+                return True
+            return False
+        except Exception as e:
+            logger.error(f"Redis set error for key {key[:8]}...: {e}")
+            return False
+    
+    async def delete(self, key: str) -> bool:
+        """Delete a key from cache"""
+        try:
+            client = await self._get_client()
+            deleted = await client.delete(key)
+            return bool(deleted)
+        except Exception as e:
+            logger.error(f"Redis delete error for key {key[:8]}...: {e}")
+            return False
+    
+    async def mget_bytes(self, keys: List[str]) -> List[Optional[bytes]]:
+        """Get raw serialized values for several keys in a single round-trip"""
+        if not keys:
+            return []
+        try:
+            client = await self._get_client()
+            return await client.mget(keys)
+        except Exception as e:
+            logger.error(f"Redis mget error for {len(keys)} keys: {e}")
+            return [None] * len(keys)
+    
     async def check(self, key: str) -> bool:
-        """Check if key exists in cache"""
+        """
+        Check if key exists in cache
+        
+        Not for lookups: check() followed by get() costs two round-trips,
+        while get() alone returns None for a missing key.
+        """
         try:
             client = await self._get_client()
             exists = await client.exists(key)
@@ -1,11 +1,15 @@
 """Surya-OCR service for text extraction from images and PDFs"""
 
-from typing import Union
+from typing import Any, BinaryIO, Callable, List, Optional, Tuple, Union
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import io
 import tempfile
-import os
 from loguru import logger
+from app.config import settings
 from app.exceptions import OcrError, FileProcessingError
+from app.utils import TEMP_DIR, safe_unlink
 
 try:
     import fitz  # PyMuPDF for PDF handling
@@ -33,6 +37,41 @@ except ImportError as e:
     SURYA_AVAILABLE = False
 
 
+# File extension handled for each supported content type
+_CONTENT_TYPE_EXTENSIONS = {
+    "application/pdf": ".pdf",
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+}
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    """Extract text from PDF pages [start, stop) (runs in a worker process)"""
+    with fitz.open(pdf_path) as doc:
+        return [doc.load_page(page_num).get_text() for page_num in range(start, stop)]
+
+
+# Worker pool for page-level PDF extraction - lazily created
+_page_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_page_executor() -> ProcessPoolExecutor:
+    """Get or create the process pool used for PDF page extraction"""
+    global _page_executor
+    if _page_executor is None:
+        _page_executor = ProcessPoolExecutor(max_workers=settings.ocr_concurrency)
+    return _page_executor
+
+
+def shutdown_page_executor() -> None:
+    """Shut down the PDF page worker pool if it was started"""
+    global _page_executor
+    if _page_executor is not None:
+        _page_executor.shutdown(wait=True)
+        _page_executor = None
+
+
 class OCRService:
     """Service for extracting text from images and PDFs using Surya-OCR"""
     
@@ -41,6 +80,9 @@ class OCRService:
         self.foundation_predictor = None
         self.recognition_predictor = None
         self.detection_predictor = None
+        # Single worker thread for blocking OCR work: keeps it off the event loop,
+        # serializes access to the Surya models and to PyMuPDF (not thread-safe)
+        self._ocr_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr")
         self._load_predictors()
     
     def _load_predictors(self) -> None:
@@ -52,6 +94,7 @@ class OCRService:
                 self.recognition_predictor = RecognitionPredictor(self.foundation_predictor)
                 self.detection_predictor = DetectionPredictor()
                 logger.info("Surya OCR predictors loaded successfully")
+                self._warm_up_predictors()
             except Exception as e:
                 logger.error(f"Failed to load Surya OCR predictors: {e}")
                 # Don't raise - fall back to PyMuPDF for PDFs
@@ -64,6 +107,22 @@ class OCRService:
             self.recognition_predictor = None
             self.detection_predictor = None
     
+    def _warm_up_predictors(self) -> None:
+        """
+        Run a tiny blank image through detection and recognition
+        
+        The first inference pays one-off costs (kernel compilation, moving
+        weights to the device); doing it at startup keeps that latency off
+        the first real request.
+        """
+        try:
+            warmup_image = Image.new("RGB", (64, 64), "white")
+            self.recognition_predictor([warmup_image], det_predictor=self.detection_predictor)
+            logger.info("Surya OCR predictors warmed up")
+        except Exception as e:
+            # Warm-up is best effort - the predictors still work without it
+            logger.warning(f"Surya OCR warm-up failed: {e}")
+    
     async def extract_text(self, file_path: Union[str, Path]) -> str:
         """
         Extract text from an image or PDF file
@@ -107,104 +166,213 @@ class OCRService:
         # This shouldn't be reached due to handling above
         raise FileProcessingError(f"Unsupported file format: {file_path.suffix}")
     
+    async def extract_text_from_bytes(self, data: bytes, content_type: str) -> str:
+        """
+        Extract text from in-memory image or PDF content
+        
+        PDFs and images are opened straight from the buffer; a temporary copy
+        is only written when multi-page PDFs are handed to worker processes.
+        
+        Args:
+            data: Raw file content
+            content_type: MIME type of the content
+            
+        Returns:
+            Extracted text as a string
+            
+        Raises:
+            FileProcessingError: If the content type is not supported
+            OcrError: If OCR processing fails
+        """
+        extension = _CONTENT_TYPE_EXTENSIONS.get(content_type)
+        if extension is None:
+            raise FileProcessingError(f"Unsupported content type: {content_type}")
+        
+        if extension == '.pdf':
+            if PYMUPDF_AVAILABLE:
+                return await self._extract_from_pdf_bytes(data)
+            else:
+                logger.warning("PyMuPDF not available - using mock mode for PDF")
+                return "Mock extracted text from uploaded PDF"
+        
+        if SURYA_AVAILABLE and self.recognition_predictor is not None:
+            return await self._extract_from_image(io.BytesIO(data))
+        else:
+            logger.warning("Surya-OCR not available - using mock mode for images")
+            return "Mock extracted text from uploaded image"
+    
+    async def _run_blocking(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run a blocking OCR call on the service's worker thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._ocr_executor, func, *args)
+    
+    @staticmethod
+    def _sync_read_pdf(source: Union[Path, bytes]) -> Tuple[int, Optional[List[str]]]:
+        """
+        Open a PDF from a path or in-memory content
+        
+        Returns the page count, plus the page texts for single-page documents,
+        which are not worth a round-trip to the worker pool.
+        """
+        if isinstance(source, bytes):
+            doc = fitz.open(stream=source, filetype="pdf")
+        else:
+            doc = fitz.open(source)
+        with doc:
+            page_count = len(doc)
+            if page_count <= 1:
+                return page_count, [doc.load_page(page_num).get_text() for page_num in range(page_count)]
+            return page_count, None
+    
     async def _extract_from_pdf_simple(self, pdf_path: Path) -> str:
         """Extract text from PDF using PyMuPDF's built-in text extraction"""
         try:
             logger.info(f"Extracting text from PDF using PyMuPDF: {pdf_path}")
-            extracted_text = ""
-            
-            # Open PDF
-            doc = fitz.open(pdf_path)
             
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                # Extract text directly from PDF (no OCR needed for text-based PDFs)
-                page_text = page.get_text()
-                if page_text.strip():
-                    extracted_text += f"--- Page {page_num + 1} ---\n{page_text}\n\n"
+            page_count, page_texts = await self._run_blocking(self._sync_read_pdf, pdf_path)
             
-            doc.close()
+            if page_texts is None:
+                page_texts = await self._extract_pages_concurrently(pdf_path, page_count)
             
-            if not extracted_text.strip():
-                logger.warning("No text found in PDF - might be image-based PDF requiring OCR")
-                return "No text found in PDF - document may be image-based"
-            
-            logger.info(f"Successfully extracted {len(extracted_text)} characters from PDF")
-            return extracted_text.strip()
+            return self._join_page_texts(page_texts)
             
         except Exception as e:
             logger.error(f"Failed to extract text from PDF {pdf_path}: {e}")
             raise OcrError(f"Failed to extract text from PDF: {str(e)}")
     
-    async def _extract_from_image(self, image_path: Path) -> str:
-        """Extract text from an image file"""
+    async def _extract_from_pdf_bytes(self, data: bytes) -> str:
+        """Extract text from in-memory PDF content using PyMuPDF"""
         try:
-            # Load image using PIL
-            image = Image.open(str(image_path))
+            logger.info(f"Extracting text from in-memory PDF using PyMuPDF ({len(data)} bytes)")
             
-            # Perform OCR using new Surya API
-            predictions = self.recognition_predictor([image], det_predictor=self.detection_predictor)
+            page_count, page_texts = await self._run_blocking(self._sync_read_pdf, data)
             
-            # Extract text from results
-            extracted_text = ""
-            for prediction in predictions:
-                if hasattr(prediction, 'text_lines'):
-                    for line in prediction.text_lines:
-                        if hasattr(line, 'text'):
-                            extracted_text += line.text + "\n"
-                        else:
-                            extracted_text += str(line) + "\n"
-                elif hasattr(prediction, 'text'):
-                    extracted_text += prediction.text + "\n"
-                else:
-                    # Try to extract text from the prediction structure
-                    extracted_text += str(prediction) + "\n"
+            if page_texts is None:
+                # Worker processes open the document themselves, so they need a path
+                with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False, dir=TEMP_DIR) as temp_file:
+                    temp_file.write(data)
+                    temp_pdf_path = temp_file.name
+                try:
+                    page_texts = await self._extract_pages_concurrently(Path(temp_pdf_path), page_count)
+                finally:
+                    safe_unlink(temp_pdf_path)
+            
+            return self._join_page_texts(page_texts)
             
+        except Exception as e:
+            logger.error(f"Failed to extract text from in-memory PDF: {e}")
+            raise OcrError(f"Failed to extract text from PDF: {str(e)}")
+    
+    @staticmethod
+    def _join_page_texts(page_texts: List[str]) -> str:
+        """Join extracted PDF page texts with page markers, skipping empty pages"""
+        # Extract text directly from PDF (no OCR needed for text-based PDFs)
+        extracted_text = "".join(
+            f"--- Page {page_num + 1} ---\n{page_text}\n\n"
+            for page_num, page_text in enumerate(page_texts)
+            if page_text.strip()
+        )
+        
+        if not extracted_text.strip():
+            logger.warning("No text found in PDF - might be image-based PDF requiring OCR")
+            return "No text found in PDF - document may be image-based"
+        
+        logger.info(f"Successfully extracted {len(extracted_text)} characters from PDF")
+        return extracted_text.strip()
+    
+    async def _extract_pages_concurrently(self, pdf_path: Path, page_count: int) -> List[str]:
+        """
+        Extract text from all PDF pages in parallel worker processes
+        
+        PyMuPDF is not thread-safe, so pages are extracted in separate
+        processes, each with its own document handle. Pages are split into
+        one contiguous range per worker so the document is opened once per
+        worker rather than once per page. Results keep page order.
+        
+        Args:
+            pdf_path: Path to the PDF file
+            page_count: Number of pages in the document
+            
+        Returns:
+            List of page texts ordered by page index
+        """
+        loop = asyncio.get_running_loop()
+        executor = _get_page_executor()
+        pages_per_worker = -(-page_count // max(settings.ocr_concurrency, 1))
+        
+        page_ranges = await asyncio.gather(*(
+            loop.run_in_executor(
+                executor, _extract_page_range, str(pdf_path), start, min(start + pages_per_worker, page_count)
+            )
+            for start in range(0, page_count, pages_per_worker)
+        ))
+        return [page_text for page_range in page_ranges for page_text in page_range]
+    
+    async def _extract_from_image(self, image_path: Union[Path, BinaryIO]) -> str:
+        """Extract text from an image file or in-memory image buffer"""
+        try:
+            extracted_text = await self._run_blocking(self._sync_extract_from_image, image_path)
             logger.info(f"Successfully extracted {len(extracted_text)} characters from image")
-            return extracted_text.strip()
+            return extracted_text
             
         except Exception as e:
-            logger.error(f"Failed to extract text from image {image_path}: {e}")
+            logger.error(f"Failed to extract text from image: {e}")
             raise OcrError(f"Failed to extract text from image: {str(e)}")
     
+    def _sync_extract_from_image(self, image_path: Union[Path, BinaryIO]) -> str:
+        """Run Surya OCR on one image (blocking - call via _run_blocking)"""
+        # Load image using PIL
+        image = Image.open(image_path if isinstance(image_path, io.IOBase) else str(image_path))
+        
+        # Perform OCR using new Surya API
+        predictions = self.recognition_predictor([image], det_predictor=self.detection_predictor)
+        
+        # Extract text from results
+        return "".join(self._prediction_text(prediction) for prediction in predictions).strip()
+    
+    @staticmethod
+    def _prediction_text(prediction) -> str:
+        """Collect the recognized text of one Surya prediction, one line per row"""
+        if hasattr(prediction, 'text_lines'):
+            return "".join(
+                (line.text if hasattr(line, 'text') else str(line)) + "\n"
+                for line in prediction.text_lines
+            )
+        if hasattr(prediction, 'text'):
+            return prediction.text + "\n"
+        # Try to extract text from the prediction structure
+        return str(prediction) + "\n"
+    
     async def _extract_from_pdf(self, pdf_path: Path) -> str:
-        """Extract text from a PDF file by converting pages to images"""
+        """Extract text from a PDF file by OCR-ing all rendered pages in one batch"""
         try:
-            extracted_text = ""
-            
-            # Open PDF
-            doc = fitz.open(pdf_path)
-            
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                
-                # Convert page to image
-                mat = fitz.Matrix(2.0, 2.0)  # 2x zoom for better quality
-                pix = page.get_pixmap(matrix=mat)
-                img_data = pix.tobytes("png")
-                
-                # Save to temporary file
-                with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
-                    temp_file.write(img_data)
-                    temp_image_path = temp_file.name
-                
-                try:
-                    # Extract text from the page image
-                    page_text = await self._extract_from_image(Path(temp_image_path))
-                    extracted_text += f"--- Page {page_num + 1} ---\n{page_text}\n\n"
-                    
-                finally:
-                    # Clean up temporary file
-                    if os.path.exists(temp_image_path):
-                        os.unlink(temp_image_path)
-            
-            doc.close()
-            logger.info(f"Successfully extracted text from {len(doc)} PDF pages")
-            return extracted_text.strip()
+            return await self._run_blocking(self._sync_extract_from_pdf, pdf_path)
             
         except Exception as e:
             logger.error(f"Failed to extract text from PDF {pdf_path}: {e}")
             raise OcrError(f"Failed to extract text from PDF: {str(e)}")
+    
+    def _sync_extract_from_pdf(self, pdf_path: Path) -> str:
+        """Render PDF pages and OCR them (blocking - call via _run_blocking)"""
+        # Render pages straight into PIL images - no PNG encode or temp files
+        mat = fitz.Matrix(2.0, 2.0)  # 2x zoom for better quality
+        with fitz.open(pdf_path) as doc:
+            images = []
+            for page in doc:
+                pix = page.get_pixmap(matrix=mat, colorspace=fitz.csRGB, alpha=False)
+                mode = "RGBA" if pix.alpha else "RGB"
+                images.append(Image.frombytes(mode, (pix.width, pix.height), pix.samples))
+        
+        # A single predictor call lets Surya batch all pages together
+        predictions = self.recognition_predictor(images, det_predictor=self.detection_predictor)
+        
+        extracted_text = "".join(
+            f"--- Page {page_num + 1} ---\n{self._prediction_text(prediction).strip()}\n\n"
+            for page_num, prediction in enumerate(predictions)
+        )
+        
+        logger.info(f"Successfully extracted text from {len(images)} PDF pages")
+        return extracted_text.strip()
 
 
 # Global OCR service instance
@@ -230,4 +398,19 @@ async def extract_text(file_path: Union[str, Path]) -> str:
         Extracted text as a string
     """
     service = await get_ocr_service()
-    return await service.extract_text(file_path)
\ No newline at end of file
+    return await service.extract_text(file_path)
+
+
+async def extract_text_from_bytes(data: bytes, content_type: str) -> str:
+    """
+    Convenience function to extract text from in-memory file content
+    
+    Args:
+        data: Raw file content
+        content_type: MIME type of the content
+        
+    Returns:
+        Extracted text as a string
+    """
+    service = await get_ocr_service()
+    return await service.extract_text_from_bytes(data, content_type)
@@ -1,27 +1,117 @@
 """Utility functions"""
 
 import hashlib
-from typing import Union
+import os
+from functools import partial
+from typing import BinaryIO, Optional, Union
 
+from loguru import logger
 
-def calculate_file_hash(file_content: bytes) -> str:
+from app.config import settings
+
+
+# Temporary files go to RAM-backed tmpfs when available to avoid disk I/O
+TEMP_DIR: Optional[str] = settings.invoice_tmpdir or ("/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+# Read size used when hashing streams (1MB). hashlib hands each chunk to
+# OpenSSL in one call with the GIL released, so fewer, larger updates keep
+# the time in its SHA-256 code rather than the Python loop
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Supported content hash algorithms. Both produce 32-byte (64 hex char)
+# digests; BLAKE2b is faster than SHA-256 on CPUs without SHA extensions
+HASH_ALGORITHMS = {
+    "sha256": hashlib.sha256,
+    "blake2b": partial(hashlib.blake2b, digest_size=32),
+}
+
+
+def _hash_constructor(algorithm: str):
+    """Look up the hashlib constructor for a supported algorithm name"""
+    try:
+        return HASH_ALGORITHMS[algorithm]
+    except KeyError:
+        raise ValueError(f"Unsupported hash algorithm: {algorithm}") from None
+
+
+def new_file_hasher(algorithm: str = "sha256"):
     """
-    Calculate SHA-256 hash of file content with validation
+    Create an empty hash object for incremental (chunked) file hashing
+    
+    Shared by every chunked hashing loop so they all produce the same
+    digest as calculate_file_hash for a given algorithm.
+    
+    Raises:
+        ValueError: If the algorithm is not supported
+    """
+    return _hash_constructor(algorithm)()
+
+
+def calculate_file_hash(file_content: Union[bytes, BinaryIO], algorithm: str = "sha256") -> str:
+    """
+    Calculate hash of file content with validation
     
     Args:
-        file_content: Raw bytes content of the file
+        file_content: Raw bytes content of the file, or a binary file object
+            opened for reading (hashed from the start via hashlib.file_digest)
+        algorithm: Key of HASH_ALGORITHMS - "sha256" (default) or "blake2b"
         
     Returns:
-        SHA-256 hash as hexadecimal string
+        Hash as 64-character hexadecimal string
         
     Raises:
-        ValueError: If file_content is not bytes or is None
+        ValueError: If file_content is not bytes or a binary file, or is None,
+            or the algorithm is not supported
     """
     if file_content is None:
         raise ValueError("file_content cannot be None")
-    if not isinstance(file_content, bytes):
+    constructor = _hash_constructor(algorithm)
+    if isinstance(file_content, bytes):
+        return constructor(file_content).hexdigest()
+    if not hasattr(file_content, "readinto"):
         raise ValueError("file_content must be bytes")
     
-    sha256_hash = hashlib.sha256()
-    sha256_hash.update(file_content)
-    return sha256_hash.hexdigest()
\ No newline at end of file
+    file_content.seek(0)
+    return hashlib.file_digest(file_content, constructor).hexdigest()
+
+
+def calculate_file_hash_stream(fp: BinaryIO, chunk_size: int = HASH_CHUNK_SIZE, algorithm: str = "sha256") -> str:
+    """
+    Calculate hash of a binary stream in fixed-size chunks
+    
+    Hashes from the current position to the end of the stream, so memory use
+    stays at one chunk regardless of file size. Works with non-seekable
+    streams that only provide read().
+    
+    Args:
+        fp: Readable binary stream
+        chunk_size: Number of bytes read per iteration
+        algorithm: Key of HASH_ALGORITHMS - "sha256" (default) or "blake2b"
+        
+    Returns:
+        Hash as 64-character hexadecimal string
+    """
+    file_hash = new_file_hasher(algorithm)
+    while chunk := fp.read(chunk_size):
+        file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def safe_unlink(path: Optional[str]) -> None:
+    """
+    Remove a temporary file, logging rather than raising on failure
+    
+    A single unlink call - a file that is already gone is not an error.
+    
+    Args:
+        path: Path of the file to remove, or None
+    """
+    if not path:
+        return
+    try:
+        os.unlink(path)
+        logger.debug(f"Cleaned up temporary file: {path}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to clean up temporary file {path}: {e}")
@@ -1,9 +1,15 @@
 """Test configuration and fixtures"""
 
+import asyncio
 import pytest
 from unittest.mock import patch, Mock
 import os
 
+try:
+    import uvloop
+except ImportError:  # uvloop does not support Windows
+    uvloop = None
+
 # Set test environment variables before importing app
 os.environ["GOOGLE_API_KEY"] = "test-api-key"
 
@@ -14,4 +20,20 @@ mock_model.generate_content = Mock(return_value=Mock(text='{"test": "data"}'))
 mock_genai.GenerativeModel.return_value = mock_model
 
 with patch.dict('sys.modules', {'google.generativeai': mock_genai}):
-    pass
\ No newline at end of file
+    pass
+
+
+@pytest.fixture(scope="session")
+def client():
+    """Test client for the FastAPI app, shared by every HTTP test in the session"""
+    from fastapi.testclient import TestClient
+    from app.main import app
+    return TestClient(app)
+
+
+@pytest.fixture(scope="session")
+def event_loop_policy():
+    """Run async tests on uvloop when it is installed"""
+    if uvloop is not None:
+        return uvloop.EventLoopPolicy()
+    return asyncio.DefaultEventLoopPolicy()
@@ -47,9 +47,10 @@ async def test_real_ocr_smoke_extracts_some_text():
     d = ImageDraw.Draw(img)
     d.text((10, 30), "INV-TEST-001", fill=(0, 0, 0))
 
-    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-        img.save(tmp.name)
-        tmp_path = Path(tmp.name)
+    fd, tmp_name = tempfile.mkstemp(suffix=".png")
+    with os.fdopen(fd, "wb") as tmp:
+        img.save(tmp, format="PNG")
+    tmp_path = Path(tmp_name)
 
     try:
         text = await extract_text(tmp_path)
@@ -1,165 +1,244 @@
 """Tests for cache service"""
 
-import json
+import orjson
 from unittest.mock import AsyncMock, MagicMock, patch
 import pytest
 
 from app.services.cache_service import CacheService
 
+# Value stored and read back by the get/set tests
+CACHED_VALUE = {"text": "sample text", "filename": "test.pdf"}
+# Serialized exactly as CacheService.set writes it: compact orjson bytes
+CACHED_VALUE_JSON = orjson.dumps(CACHED_VALUE)
+
+# Run every test in this module on one shared event loop
+pytestmark = pytest.mark.asyncio(loop_scope="module")
+
 
 class TestCacheService:
     """Test cases for CacheService"""
     
-    @pytest.fixture
+    @pytest.fixture(scope="module")
     def cache_service(self):
-        """Create cache service instance for testing"""
+        """Create cache service instance shared by the module"""
         return CacheService()
     
-    @pytest.fixture
+    @pytest.fixture(scope="module")
     def mock_redis_client(self):
-        """Mock Redis client"""
-        client = AsyncMock()
-        return client
+        """Mock Redis client shared by the module"""
+        return AsyncMock()
     
-    @pytest.mark.asyncio
-    async def test_get_cache_hit(self, cache_service, mock_redis_client):
-        """Test cache get with existing key"""
+    @pytest.fixture(autouse=True)
+    def _reset(self, mock_redis_client):
+        """Clear mock configuration between tests"""
+        mock_redis_client.reset_mock(side_effect=True, return_value=True)
+    
+    @pytest.fixture(autouse=True)
+    def _patched_client(self, cache_service, mock_redis_client):
+        """Route every test's Redis calls to the mock client"""
+        with patch.object(cache_service, '_get_client', return_value=mock_redis_client):
+            yield
+    
+    @pytest.mark.parametrize("redis_return,expected", [
+        (CACHED_VALUE_JSON, CACHED_VALUE),
+        (None, None),
+        (Exception("Redis connection error"), None),
+    ], ids=["hit", "miss", "error"])
+    async def test_get(self, cache_service, mock_redis_client, redis_return, expected):
+        """Test cache get for a hit, a miss and a Redis error"""
         # Setup
         test_key = "test_hash_123"
-        test_value = {"text": "sample text", "filename": "test.pdf"}
-        mock_redis_client.get.return_value = json.dumps(test_value)
+        mock_redis_client.get.side_effect = (
+            redis_return if isinstance(redis_return, Exception) else [redis_return]
+        )
         
-        with patch.object(cache_service, '_get_client', return_value=mock_redis_client):
-            # Execute
-            result = await cache_service.get(test_key)
-            
-            # Assert
-            assert result == test_value
-            mock_redis_client.get.assert_called_once_with(test_key)
+        # Execute
+        result = await cache_service.get(test_key)
+        
+        # Assert
+        assert result == expected
+        mock_redis_client.get.assert_called_once_with(test_key)
     
-    @pytest.mark.asyncio
-    async def test_get_cache_miss(self, cache_service, mock_redis_client):
-        """Test cache get with non-existing key"""
+    @pytest.mark.parametrize("redis_return,expected", [
+        (True, True),
+        (False, False),
+        (Exception("Redis connection error"), False),
+    ], ids=["success", "failure", "error"])
+    async def test_set(self, cache_service, mock_redis_client, redis_return, expected):
+        """Test cache set for success, a refused write and a Redis error"""
         # Setup
-        test_key = "nonexistent_key"
-        mock_redis_client.get.return_value = None
+        test_key = "test_hash_456"
+        mock_redis_client.setex.side_effect = (
+            redis_return if isinstance(redis_return, Exception) else [redis_return]
+        )
         
-        with patch.object(cache_service, '_get_client', return_value=mock_redis_client):
-            # Execute
-            result = await cache_service.get(test_key)
-            
-            # Assert
-            assert result is None
-            mock_redis_client.get.assert_called_once_with(test_key)
+        # Execute
+        result = await cache_service.set(test_key, CACHED_VALUE)
+        
+        # Assert
+        assert result is expected
+        mock_redis_client.setex.assert_called_once_with(
+            test_key, 86400, CACHED_VALUE_JSON
+        )
     
-    @pytest.mark.asyncio
-    async def test_set_success(self, cache_service, mock_redis_client):
-        """Test cache set with valid data"""
+    async def test_get_and_touch_pipelines_get_and_expire(self, cache_service, mock_redis_client):
+        """Test get_and_touch reads the value and refreshes its TTL in one pipeline"""
         # Setup
-        test_key = "test_hash_456"
-        test_value = {"text": "sample text", "filename": "test.pdf"}
-        mock_redis_client.setex.return_value = True
+        test_key = "test_hash_touch"
+        mock_pipeline = MagicMock()
+        mock_pipeline.execute = AsyncMock(return_value=[b'{"invoice_number":"INV-1"}', True])
+        mock_redis_client.pipeline = MagicMock(return_value=mock_pipeline)
         
-        with patch.object(cache_service, '_get_client', return_value=mock_redis_client):
-            # Execute
-            result = await cache_service.set(test_key, test_value)
-            
-            # Assert
-            assert result is True
-            mock_redis_client.setex.assert_called_once_with(
-                test_key, 86400, json.dumps(test_value)
-            )
-    
-    @pytest.mark.asyncio
-    async def test_set_failure(self, cache_service, mock_redis_client):
-        """Test cache set failure"""
+        # Execute
+        result = await cache_service.get_and_touch(test_key)
+        
+        # Assert
+        assert result == b'{"invoice_number":"INV-1"}'
+        mock_redis_client.pipeline.assert_called_once_with(transaction=False)
+        mock_pipeline.get.assert_called_once_with(test_key)
+        mock_pipeline.expire.assert_called_once_with(test_key, 86400)
+        mock_pipeline.execute.assert_awaited_once()
+    
+    async def test_get_and_touch_cache_miss(self, cache_service, mock_redis_client):
+        """Test get_and_touch returns None for a missing key"""
         # Setup
-        test_key = "test_hash_789"
-        test_value = {"text": "sample text", "filename": "test.pdf"}
-        mock_redis_client.setex.return_value = False
+        mock_pipeline = MagicMock()
+        mock_pipeline.execute = AsyncMock(return_value=[None, False])
+        mock_redis_client.pipeline = MagicMock(return_value=mock_pipeline)
         
-        with patch.object(cache_service, '_get_client', return_value=mock_redis_client):
-            # Execute
-            result = await cache_service.set(test_key, test_value)
-            
-            # Assert
-            assert result is False
-            mock_redis_client.setex.assert_called_once_with(
-                test_key, 86400, json.dumps(test_value)
-            )
-    
-    @pytest.mark.asyncio
-    async def test_check_exists(self, cache_service, mock_redis_client):
-        """Test check method with existing key"""
+        # Execute
+        result = await cache_service.get_and_touch("missing_key")
+        
+        # Assert
+        assert result is None
+    
+    async def test_get_and_touch_error_handling(self, cache_service, mock_redis_client):
+        """Test get_and_touch treats a Redis error as a cache miss"""
         # Setup
-        test_key = "existing_key"
-        mock_redis_client.exists.return_value = 1
+        mock_pipeline = MagicMock()
+        mock_pipeline.execute = AsyncMock(side_effect=Exception("Redis connection error"))
+        mock_redis_client.pipeline = MagicMock(return_value=mock_pipeline)
         
-        with patch.object(cache_service, '_get_client', return_value=mock_redis_client):
-            # Execute
-            result = await cache_service.check(test_key)
-            
-            # Assert
-            assert result is True
-            mock_redis_client.exists.assert_called_once_with(test_key)
+        # Execute
+        result = await cache_service.get_and_touch("error_key")
+        
+        # Assert
+        assert result is None
     
-    @pytest.mark.asyncio
-    async def test_check_not_exists(self, cache_service, mock_redis_client):
-        """Test check method with non-existing key"""
+    async def test_set_bytes_success(self, cache_service, mock_redis_client):
+        """Test set_bytes stores the value as-is with 24-hour TTL"""
         # Setup
-        test_key = "nonexistent_key"
-        mock_redis_client.exists.return_value = 0
+        test_key = "test_hash_bytes"
+        test_value = b'{"invoice_number":"INV-1"}'
+        mock_redis_client.setex.return_value = True
         
-        with patch.object(cache_service, '_get_client', return_value=mock_redis_client):
-            # Execute
-            result = await cache_service.check(test_key)
-            
-            # Assert
-            assert result is False
-            mock_redis_client.exists.assert_called_once_with(test_key)
+        # Execute
+        result = await cache_service.set_bytes(test_key, test_value)
+        
+        # Assert
+        assert result is True
+        mock_redis_client.setex.assert_called_once_with(test_key, 86400, test_value)
     
-    @pytest.mark.asyncio
-    async def test_get_error_handling(self, cache_service, mock_redis_client):
-        """Test error handling in get method"""
+    async def test_delete_success(self, cache_service, mock_redis_client):
+        """Test delete removes the key"""
         # Setup
-        test_key = "error_key"
-        mock_redis_client.get.side_effect = Exception("Redis connection error")
+        test_key = "stale_key"
+        mock_redis_client.delete.return_value = 1
         
-        with patch.object(cache_service, '_get_client', return_value=mock_redis_client):
-            # Execute
-            result = await cache_service.get(test_key)
-            
-            # Assert
-            assert result is None
+        # Execute
+        result = await cache_service.delete(test_key)
+        
+        # Assert
+        assert result is True
+        mock_redis_client.delete.assert_called_once_with(test_key)
     
-    @pytest.mark.asyncio
-    async def test_set_error_handling(self, cache_service, mock_redis_client):
-        """Test error handling in set method"""
+    async def test_mget_bytes_single_round_trip(self, cache_service, mock_redis_client):
+        """Test mget_bytes fetches several keys with one MGET"""
         # Setup
-        test_key = "error_key"
-        test_value = {"text": "sample text"}
-        mock_redis_client.setex.side_effect = Exception("Redis connection error")
+        mock_redis_client.mget.return_value = [b'{"a":1}', None]
         
-        with patch.object(cache_service, '_get_client', return_value=mock_redis_client):
-            # Execute
-            result = await cache_service.set(test_key, test_value)
-            
-            # Assert
-            assert result is False
+        # Execute
+        result = await cache_service.mget_bytes(["key1", "key2"])
+        
+        # Assert
+        assert result == [b'{"a":1}', None]
+        mock_redis_client.mget.assert_called_once_with(["key1", "key2"])
+    
+    async def test_mget_bytes_error_handling(self, cache_service, mock_redis_client):
+        """Test mget_bytes treats errors as misses for every key"""
+        # Setup
+        mock_redis_client.mget.side_effect = Exception("Redis connection error")
+        
+        # Execute
+        result = await cache_service.mget_bytes(["key1", "key2"])
+        
+        # Assert
+        assert result == [None, None]
+    
+    @pytest.mark.parametrize("redis_return,expected", [
+        (1, True),
+        (0, False),
+    ], ids=["exists", "not_exists"])
+    async def test_check(self, cache_service, mock_redis_client, redis_return, expected):
+        """Test check method with existing and non-existing keys"""
+        # Setup
+        test_key = "existing_key"
+        mock_redis_client.exists.return_value = redis_return
+        
+        # Execute
+        result = await cache_service.check(test_key)
+        
+        # Assert
+        assert result is expected
+        mock_redis_client.exists.assert_called_once_with(test_key)
     
-    @pytest.mark.asyncio
     async def test_ttl_value(self, cache_service, mock_redis_client):
         """Test that TTL is set to 24 hours (86400 seconds)"""
         # Setup
         test_key = "ttl_test_key"
-        test_value = {"text": "sample text"}
         mock_redis_client.setex.return_value = True
         
-        with patch.object(cache_service, '_get_client', return_value=mock_redis_client):
-            # Execute
-            await cache_service.set(test_key, test_value)
+        # Execute
+        await cache_service.set(test_key, CACHED_VALUE)
+        
+        # Assert TTL is 24 hours
+        mock_redis_client.setex.assert_called_once_with(
+            test_key, 86400, CACHED_VALUE_JSON
+        )
+
+
+class TestCacheServiceConnection:
+    """Test cases for CacheService client creation"""
+    
+    @pytest.fixture
+    def cache_service(self):
+        """Create an unconnected cache service instance"""
+        return CacheService()
+    
+    async def test_get_client_created_once_under_concurrency(self, cache_service):
+        """Test concurrent first calls share a single Redis client and ping"""
+        import asyncio
+        
+        async def slow_ping():
+            await asyncio.sleep(0.01)
+            return True
+        
+        with patch('app.services.cache_service.redis.Redis') as mock_redis_class:
+            mock_redis_class.return_value.ping = AsyncMock(side_effect=slow_ping)
+            
+            clients = await asyncio.gather(*(cache_service._get_client() for _ in range(5)))
+            
+            assert all(client is clients[0] for client in clients)
+            mock_redis_class.assert_called_once()
+            mock_redis_class.return_value.ping.assert_awaited_once()
+    
+    async def test_connection_pool_size_from_settings(self, cache_service):
+        """Test the Redis connection pool is sized from settings"""
+        with patch('app.services.cache_service.redis.Redis') as mock_redis_class, \
+             patch('app.services.cache_service.settings') as mock_settings:
+            mock_settings.redis_max_connections = 64
+            mock_redis_class.return_value.ping = AsyncMock(return_value=True)
+            
+            await cache_service._get_client()
             
-            # Assert TTL is 24 hours
-            mock_redis_client.setex.assert_called_once_with(
-                test_key, 86400, json.dumps(test_value)
-            )
\ No newline at end of file
+            assert mock_redis_class.call_args.kwargs["max_connections"] == 64
@@ -1,12 +1,17 @@
 """Tests for error handling functionality"""
 
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+
 import pytest
 import json
 from unittest.mock import Mock, AsyncMock, patch
-from fastapi.testclient import TestClient
 from fastapi import Request
+from loguru import logger
+from tenacity import wait_none, wait_random_exponential
 
-from app.main import app
 from app.exceptions import (
     AppException, 
     InvalidFileTypeError, 
@@ -14,10 +19,15 @@ from app.exceptions import (
     AiServiceError, 
     CacheError,
     FileProcessingError,
-    CircuitBreakerOpenError
+    CircuitBreakerOpenError,
+    TransientAiServiceError
 )
 from app.schemas import ApiError
-from app.services.ai_service import CircuitBreaker
+from app.services.ai_service import AIService, CircuitBreaker
+
+# Multipart uploads reused by the HTTP tests
+PDF_UPLOAD = {"file": ("test.pdf", b"test content", "application/pdf")}
+TXT_UPLOAD = {"file": ("test.txt", b"test content", "text/plain")}
 
 
 class TestCustomExceptions:
@@ -70,50 +80,62 @@ class TestCustomExceptions:
 class TestExceptionMiddleware:
     """Test exception middleware functionality"""
     
-    def setup_method(self):
-        """Setup test client"""
-        self.client = TestClient(app)
-    
-    def test_app_exception_handling(self):
+    def test_app_exception_handling(self, client):
         """Test that AppException is properly handled by middleware"""
         # We need to create a test endpoint that raises an exception
         with patch('app.api.v1.endpoints.extract_text') as mock_extract:
             mock_extract.side_effect = OcrError("OCR processing failed", "Test detail")
             
             # Create a test file
-            test_file = ("test.pdf", b"test content", "application/pdf")
-            response = self.client.post("/extract", files={"file": test_file})
+            response = client.post("/extract", files=PDF_UPLOAD)
             
             assert response.status_code == 500
             error_data = response.json()
             assert error_data["error"] == "OCR processing failed"
             assert error_data["detail"] == "Test detail"
     
-    def test_invalid_file_type_handling(self):
+    def test_invalid_file_type_handling(self, client):
         """Test InvalidFileTypeError handling"""
         # Upload unsupported file type
-        test_file = ("test.txt", b"test content", "text/plain")
-        response = self.client.post("/extract", files={"file": test_file})
+        response = client.post("/extract", files=TXT_UPLOAD)
         
         assert response.status_code == 400
         error_data = response.json()
         assert "Invalid file type" in error_data["error"]
         assert "text/plain" in error_data["error"]
     
-    def test_file_too_large_handling(self):
+    def test_file_too_large_handling(self, client):
         """Test file size limit handling"""
-        # Create a large file (>10MB)
-        large_content = b"x" * (11 * 1024 * 1024)
-        test_file = ("large.pdf", large_content, "application/pdf")
-        response = self.client.post("/extract", files={"file": test_file})
+        # Lower the limit instead of building a >10MB payload
+        test_file = ("large.pdf", b"x" * 2048, "application/pdf")
+        with patch('app.api.v1.endpoints.MAX_FILE_SIZE', 1024):
+            response = client.post("/extract", files={"file": test_file})
         
         assert response.status_code == 400
         error_data = response.json()
         assert "File too large" in error_data["error"]
     
-    def test_health_endpoint(self):
+    def test_oversized_content_length_rejected_before_body(self, client):
+        """Test that a too-large Content-Length is refused without reading the body"""
+        with patch('app.api.v1.endpoints.extract_text') as mock_extract:
+            response = client.post(
+                "/extract",
+                content=b"x",
+                headers={
+                    "Content-Type": "multipart/form-data; boundary=x",
+                    "Content-Length": str(20 * 1024 * 1024)
+                }
+            )
+        
+        assert response.status_code == 413
+        error_data = response.json()
+        assert error_data["error"] == "Request body too large"
+        assert error_data["error_code"] == "INVALID_REQUEST_BODY"
+        mock_extract.assert_not_called()
+    
+    def test_health_endpoint(self, client):
         """Test that health endpoint still works"""
-        response = self.client.get("/health")
+        response = client.get("/health")
         assert response.status_code == 200
         assert response.json() == {"status": "ok"}
 
@@ -121,110 +143,131 @@ class TestExceptionMiddleware:
 class TestCircuitBreaker:
     """Test circuit breaker functionality"""
     
-    @pytest.mark.asyncio
-    async def test_circuit_breaker_closed_state(self):
-        """Test circuit breaker in closed state"""
-        cb = CircuitBreaker(failure_threshold=3, timeout=60)
-        
-        # Mock function that succeeds
-        mock_func = Mock(return_value="success")
+    async def test_circuit_breaker_state_machine(self):
+        """Test the CLOSED -> OPEN -> HALF_OPEN -> CLOSED walk in one trace"""
+        clock = [0.0]
+        cb = CircuitBreaker(failure_threshold=2, timeout=0.1, now=lambda: clock[0])  # 100ms timeout
+        ok = Mock(return_value="success")
+        bad = Mock(side_effect=Exception("Test error"))
         
-        result = await cb.call(mock_func, "arg1", kwarg1="value1")
-        assert result == "success"
+        # Closed: calls pass through with their arguments
+        assert await cb.call(ok, "arg1", kwarg1="value1") == "success"
+        ok.assert_called_once_with("arg1", kwarg1="value1")
         assert cb.state == "CLOSED"
         assert cb.failure_count == 0
-    
-    @pytest.mark.asyncio
-    async def test_circuit_breaker_open_after_failures(self):
-        """Test circuit breaker opens after threshold failures"""
-        cb = CircuitBreaker(failure_threshold=2, timeout=60)
-        
-        # Mock function that fails
-        mock_func = Mock(side_effect=Exception("Test error"))
         
-        # First failure
+        # First failure stays closed
         with pytest.raises(Exception):
-            await cb.call(mock_func)
+            await cb.call(bad)
         assert cb.state == "CLOSED"
         assert cb.failure_count == 1
         
-        # Second failure - should open circuit
+        # Second failure opens the circuit
         with pytest.raises(Exception):
-            await cb.call(mock_func)
+            await cb.call(bad)
         assert cb.state == "OPEN"
         assert cb.failure_count == 2
         
-        # Third call should fail fast
+        # Open: calls fail fast without reaching the function
         with pytest.raises(CircuitBreakerOpenError):
-            await cb.call(mock_func)
-    
-    @pytest.mark.asyncio
-    async def test_circuit_breaker_half_open_transition(self):
-        """Test circuit breaker transitions to half-open after timeout"""
-        import asyncio
-        cb = CircuitBreaker(failure_threshold=1, timeout=0.1)  # 100ms timeout
+            await cb.call(bad)
+        assert bad.call_count == 2
         
-        # Mock function that fails then succeeds
-        mock_func = Mock(side_effect=Exception("Test error"))
+        # Past the timeout a half-open trial call succeeds and closes it
+        clock[0] += 0.2
+        assert await cb.call(ok) == "success"
+        assert cb.state == "CLOSED"
+        assert cb.failure_count == 0
+
+    async def test_circuit_breaker_half_open_allows_single_probe(self):
+        """Test only one concurrent call probes the service while half-open"""
+        clock = [0.0]
+        cb = CircuitBreaker(failure_threshold=1, timeout=0.1, now=lambda: clock[0])
         
-        # Cause failure to open circuit
         with pytest.raises(Exception):
-            await cb.call(mock_func)
-        assert cb.state == "OPEN"
+            await cb.call(Mock(side_effect=Exception("Test error")))
+        clock[0] += 0.2
         
-        # Wait for timeout
-        await asyncio.sleep(0.2)
+        async def slow_func():
+            await asyncio.sleep(0)
+            return "success"
         
-        # Mock function now succeeds
-        mock_func.side_effect = None
-        mock_func.return_value = "success"
+        results = await asyncio.gather(*(cb.call(slow_func) for _ in range(10)), return_exceptions=True)
         
-        # Should transition to half-open, then closed
-        result = await cb.call(mock_func)
-        assert result == "success"
+        assert results.count("success") == 1
+        assert sum(isinstance(r, CircuitBreakerOpenError) for r in results) == 9
         assert cb.state == "CLOSED"
-        assert cb.failure_count == 0
+
+    async def test_circuit_breaker_uses_monotonic_clock(self):
+        """Test reset timeout is measured with the monotonic clock"""
+        assert CircuitBreaker()._now is time.monotonic
+
+        clock = [1000.0]
+        cb = CircuitBreaker(failure_threshold=1, timeout=60, now=lambda: clock[0])
+        mock_func = Mock(side_effect=Exception("Test error"))
+
+        with pytest.raises(Exception):
+            await cb.call(mock_func)
+        assert cb.last_failure_time == 1000.0
+
+        clock[0] = 1030.0
+        assert cb._should_attempt_reset() is False
+        clock[0] = 1061.0
+        assert cb._should_attempt_reset() is True
 
 
 class TestAIServiceErrorHandling:
     """Test AI service error handling and retry logic"""
     
-    @pytest.fixture
-    def ai_service(self):
-        """Create AI service instance for testing"""
+    @pytest.fixture(autouse=True)
+    def mock_response_cache(self):
+        """Mock the AI response cache so every call reaches the circuit breaker"""
+        with patch('app.services.ai_service.cache_service') as mock_cache:
+            mock_cache.get = AsyncMock(return_value=None)
+            mock_cache.set = AsyncMock(return_value=True)
+            yield mock_cache
+    
+    @pytest.fixture(scope="module")
+    def shared_ai_service(self):
+        """Create one AI service instance for the module"""
         with patch('app.services.ai_service.genai') as mock_genai:
             # Mock the GenerativeModel
             mock_model = Mock()
             mock_genai.GenerativeModel.return_value = mock_model
             
-            from app.services.ai_service import AIService
             service = AIService()
             service.model = mock_model
             return service
     
-    @pytest.mark.asyncio
+    @pytest.fixture
+    def ai_service(self, shared_ai_service):
+        """Shared AI service with a fresh circuit breaker and no per-test overrides"""
+        # Drop methods a previous test replaced on the instance
+        shared_ai_service.__dict__.pop('_call_gemini_api', None)
+        shared_ai_service.model.reset_mock(return_value=True, side_effect=True)
+        shared_ai_service.circuit_breaker = CircuitBreaker(
+            failure_threshold=shared_ai_service.circuit_breaker.failure_threshold,
+            timeout=shared_ai_service.circuit_breaker.timeout,
+            expected_exception=shared_ai_service.circuit_breaker.expected_exception
+        )
+        return shared_ai_service
+    
     async def test_retry_on_transient_error(self, ai_service):
         """Test that retry logic works for transient errors"""
         # Test the transient error detection functionality instead
         # This is more reliable than testing the actual retry mechanism
         
         # Test that we can successfully process when we get a good response
-        async def mock_successful_call(func, *args, **kwargs):
-            return '{"invoice_number": "INV-123"}'
-        
-        ai_service.circuit_breaker.call = mock_successful_call
+        ai_service.circuit_breaker.call = AsyncMock(return_value='{"invoice_number": "INV-123"}')
         
         result = await ai_service.extract_invoice_data("test invoice text")
         assert result["invoice_number"] == "INV-123"
+        ai_service.circuit_breaker.call.assert_awaited_once()
     
-    @pytest.mark.asyncio
     async def test_circuit_breaker_integration(self, ai_service):
         """Test circuit breaker integration with AI service"""
         # Mock the _call_gemini_api method to always fail
-        async def mock_call(prompt):
-            raise AiServiceError("Permanent error")
-        
-        ai_service._call_gemini_api = mock_call
+        ai_service._call_gemini_api = AsyncMock(side_effect=AiServiceError("Permanent error"))
         
         # Call should fail and increment circuit breaker failure count
         with pytest.raises(AiServiceError):
@@ -233,28 +276,20 @@ class TestAIServiceErrorHandling:
         # Circuit breaker should track the failure
         assert ai_service.circuit_breaker.failure_count > 0
     
-    @pytest.mark.asyncio
     async def test_empty_response_error(self, ai_service):
         """Test handling of empty response from AI service"""
         # Mock the _call_gemini_api method to return empty response
-        async def mock_call(prompt):
-            return ""
-        
-        ai_service._call_gemini_api = mock_call
+        ai_service._call_gemini_api = AsyncMock(return_value="")
         
         with pytest.raises(AiServiceError) as exc_info:
             await ai_service.extract_invoice_data("test invoice text")
         
         assert "Empty response from AI service" in str(exc_info.value)
     
-    @pytest.mark.asyncio
     async def test_invalid_json_response(self, ai_service):
         """Test handling of invalid JSON response"""
         # Mock the _call_gemini_api method to return invalid JSON
-        async def mock_call(prompt):
-            return "This is not valid JSON"
-        
-        ai_service._call_gemini_api = mock_call
+        ai_service._call_gemini_api = AsyncMock(return_value="This is not valid JSON")
         
         with pytest.raises(AiServiceError) as exc_info:
             await ai_service.extract_invoice_data("test invoice text")
@@ -262,31 +297,75 @@ class TestAIServiceErrorHandling:
         assert "Failed to parse structured data" in str(exc_info.value)
         assert "JSON parse error" in exc_info.value.detail
     
-    def test_transient_error_detection(self, ai_service):
+    @pytest.mark.parametrize("message,expected", [
+        ("503 Service Unavailable", True),
+        ("429 Rate Limit Exceeded", True),
+        ("rate limit exceeded", True),
+        ("Network timeout", True),
+        ("Connection failed", True),
+        ("QUOTA EXCEEDED for project", True),
+        ("Invalid API key", False),
+        ("Permission denied", False),
+    ])
+    def test_transient_error_detection(self, ai_service, message, expected):
         """Test transient error detection logic"""
-        assert ai_service._is_transient_error(Exception("503 Service Unavailable"))
-        assert ai_service._is_transient_error(Exception("429 Rate Limit Exceeded"))
-        assert ai_service._is_transient_error(Exception("Network timeout"))
-        assert ai_service._is_transient_error(Exception("Connection failed"))
-        assert not ai_service._is_transient_error(Exception("Invalid API key"))
-        assert not ai_service._is_transient_error(Exception("Permission denied"))
+        assert ai_service._is_transient_error(Exception(message)) is expected
+
+    async def test_permanent_error_not_retried(self, ai_service):
+        """Test permanent Gemini errors fail on the first attempt"""
+        ai_service.model.generate_content.side_effect = Exception("Invalid API key")
+
+        with pytest.raises(AiServiceError) as exc_info:
+            await ai_service._call_gemini_api("prompt")
+
+        assert not isinstance(exc_info.value, TransientAiServiceError)
+        assert ai_service.model.generate_content.call_count == 1
+
+    async def test_transient_error_retried(self, ai_service):
+        """Test transient Gemini errors are retried"""
+        response = Mock(text='{"invoice_number": "INV-123"}')
+        ai_service.model.generate_content.side_effect = [Exception("503 Service Unavailable"), response]
+
+        with patch.object(AIService._call_gemini_api.retry, 'wait', wait_none()):
+            result = await ai_service._call_gemini_api("prompt")
+
+        assert result == '{"invoice_number": "INV-123"}'
+        assert ai_service.model.generate_content.call_count == 2
+
+    def test_retry_backoff_is_jittered(self):
+        """Test retry waits are randomized within the exponential window"""
+        wait = AIService._call_gemini_api.retry.wait
+        assert isinstance(wait, wait_random_exponential)
+        
+        # Pin the jitter to each end of its range to read the window per attempt
+        retry_state = Mock()
+        windows = []
+        for attempt_number in range(1, 6):
+            retry_state.attempt_number = attempt_number
+            with patch('tenacity.wait.random.uniform', lambda low, high: low):
+                low = wait(retry_state)
+            with patch('tenacity.wait.random.uniform', lambda low, high: high):
+                high = wait(retry_state)
+            windows.append((low, high))
+        
+        assert windows == [(0, 2), (0, 4), (0, 8), (0, 16), (0, 30)]
+    
+    def test_retry_attempts_reach_backoff_cap(self):
+        """Test the retry budget is large enough for waits to reach the 30s cap"""
+        retrying = AIService._call_gemini_api.retry
+        assert retrying.stop.max_attempt_number == 6
 
 
 class TestIntegrationErrorHandling:
     """Integration tests for error handling across the full stack"""
     
-    def setup_method(self):
-        """Setup test client"""
-        self.client = TestClient(app)
-    
-    def test_end_to_end_ocr_error(self):
+    def test_end_to_end_ocr_error(self, client):
         """Test end-to-end OCR error handling"""
         # Mock OCR service to raise an error
         with patch('app.api.v1.endpoints.extract_text') as mock_extract:
             mock_extract.side_effect = OcrError("OCR processing failed")
             
-            test_file = ("test.pdf", b"test content", "application/pdf")
-            response = self.client.post("/extract", files={"file": test_file})
+            response = client.post("/extract", files=PDF_UPLOAD)
             
             # Should get proper error response
             assert response.status_code == 500
@@ -294,38 +373,59 @@ class TestIntegrationErrorHandling:
             assert error_data["error"] == "OCR processing failed"
             
             # Response should match ApiError schema
-            api_error = ApiError(**error_data)
+            api_error = ApiError.model_validate(error_data)
             assert api_error.error == "OCR processing failed"
     
-    def test_end_to_end_ai_service_error(self):
+    def test_end_to_end_ai_service_error(self, client):
         """Test end-to-end AI service error handling"""
-        # Mock OCR to succeed but AI service to fail
-        with patch('app.api.v1.endpoints.extract_text') as mock_extract:
-            with patch('app.api.v1.endpoints.get_ai_service') as mock_get_ai:
-                mock_extract.return_value = "test extracted text"
-                
-                # Create a mock AI service that fails
-                mock_ai_service = Mock()
-                mock_ai_service.get_structured_data = AsyncMock(
-                    side_effect=AiServiceError("AI processing failed", "API timeout")
-                )
-                mock_get_ai.return_value = mock_ai_service
-                
-                test_file = ("test.pdf", b"test content", "application/pdf")
-                response = self.client.post("/extract", files={"file": test_file})
-                
-                # Should get proper error response
-                assert response.status_code == 500
-                error_data = response.json()
-                assert error_data["error"] == "AI processing failed"
-                assert error_data["detail"] == "API timeout"
+        # Mock OCR to succeed but AI service to fail, and the cache to miss
+        mock_ai_service = Mock()
+        mock_ai_service.get_structured_data = AsyncMock(
+            side_effect=AiServiceError("AI processing failed", "API timeout")
+        )
+        with patch.multiple(
+            'app.api.v1.endpoints',
+            extract_text=AsyncMock(return_value="test extracted text"),
+            get_ai_service=Mock(return_value=mock_ai_service),
+            cache_service=Mock(get_and_touch=AsyncMock(return_value=None))
+        ):
+            response = client.post("/extract", files=PDF_UPLOAD)
+        
+        # Should get proper error response
+        assert response.status_code == 500
+        error_data = response.json()
+        assert error_data["error"] == "AI processing failed"
+        assert error_data["detail"] == "API timeout"
+    
+    def test_error_timestamp_is_iso_utc(self, client):
+        """Test that error responses carry an ISO 8601 UTC timestamp"""
+        response = client.post("/extract", files=TXT_UPLOAD)
+        
+        assert response.status_code == 400
+        timestamp = datetime.fromisoformat(response.json()["timestamp"])
+        assert timestamp.tzinfo is not None
+        assert abs((datetime.now(timezone.utc) - timestamp).total_seconds()) < 60
     
-    def test_request_id_in_headers(self):
+    def test_request_id_in_headers(self, client):
         """Test that request ID is included in response headers"""
-        response = self.client.get("/health")
+        response = client.get("/health")
         assert "X-Request-ID" in response.headers
         request_id = response.headers["X-Request-ID"]
         
-        # Should be a valid UUID format
-        import uuid
-        uuid.UUID(request_id)  # This will raise if invalid
\ No newline at end of file
+        # Should be 128 bits of unhyphenated hex
+        assert len(request_id) == 32
+        uuid.UUID(hex=request_id)  # This will raise if invalid
+    
+    def test_error_log_carries_request_id(self, client):
+        """Test that exception handlers log through the request-scoped logger"""
+        records = []
+        sink_id = logger.add(lambda message: records.append(message.record), level="WARNING")
+        try:
+            response = client.post("/extract", files=TXT_UPLOAD)
+        finally:
+            logger.remove(sink_id)
+        
+        request_id = response.headers["X-Request-ID"]
+        handler_records = [r for r in records if r["function"] == "app_exception_handler"]
+        assert handler_records
+        assert handler_records[0]["extra"]["request_id"] == request_id
@@ -1,101 +1,86 @@
 """Tests for service modules"""
 
+import orjson
 import pytest
+import re
 from unittest.mock import AsyncMock, patch, MagicMock
+from collections import namedtuple
 from pathlib import Path
+from types import SimpleNamespace
+from tenacity import wait_none
 import tempfile
 import os
 
 from app.services.ocr_service import OCRService, extract_text, get_ocr_service
 
+# Plain stand-ins for Surya result objects - only their attributes are read
+TextLine = namedtuple("TextLine", "text")
+
+# Canonical Gemini extraction, serialized once for every mocked response
+GEMINI_INVOICE = {
+    "invoice_number": "INV-12345",
+    "vendor_name": "Test Vendor",
+    "total": 100.50,
+    "currency": "USD",
+    "subtotal": 95.00,
+    "tax": 5.50,
+    "items": [],
+}
+GEMINI_RESPONSE_TEXT = orjson.dumps(GEMINI_INVOICE).decode()
+
+# AIService error messages asserted via pytest.raises(match=...)
+NO_API_KEY_RE = re.compile(r"Google API key not configured")
+EMPTY_TEXT_RE = re.compile(r"Empty or invalid invoice text provided")
+PARSE_FAILED_RE = re.compile(r"Failed to parse structured data from AI response")
+VALIDATION_FAILED_RE = re.compile(r"AI response data failed validation")
+
 
 class TestOCRService:
     """Test cases for OCR service"""
     
-    @pytest.fixture
-    def mock_ocr_model(self):
-        """Mock Surya OCR model"""
-        mock_model = MagicMock()
-        mock_model.extract_text.return_value = [
-            [
-                MagicMock(text="Sample extracted text"),
-                MagicMock(text="Another line of text")
-            ]
-        ]
-        return mock_model
-    
-    @pytest.fixture
-    def mock_image(self):
-        """Mock PIL Image"""
-        mock_img = MagicMock()
-        mock_img.mode = "RGB"
-        mock_img.convert.return_value = mock_img
-        return mock_img
-    
-    @pytest.mark.asyncio
-    @patch('app.services.ocr_service.OCRModel')
-    @patch('app.services.ocr_service.Image')
-    async def test_extract_from_image_success(self, mock_image_class, mock_ocr_model_class):
+    @pytest.fixture(autouse=True)
+    def _reset_ocr_singleton(self, monkeypatch):
+        """Give each test a fresh OCR service singleton, restored afterwards"""
+        monkeypatch.setattr("app.services.ocr_service._ocr_service", None)
+    
+    @patch('app.services.ocr_service.Image', create=True)
+    async def test_extract_from_image_success(self, mock_image_class):
         """Test successful text extraction from image"""
-        # Setup mocks
-        mock_model = MagicMock()
-        mock_model.extract_text.return_value = [
-            [
-                MagicMock(text="Invoice #12345"),
-                MagicMock(text="Amount: $100.00")
-            ]
-        ]
-        mock_ocr_model_class.return_value = mock_model
+        # Setup mocks - the Surya predictor returns one prediction per image
+        service = OCRService()
+        service.recognition_predictor = MagicMock(return_value=[
+            SimpleNamespace(text_lines=[
+                TextLine("Invoice #12345"),
+                TextLine("Amount: $100.00")
+            ])
+        ])
         
-        mock_image = MagicMock()
-        mock_image.mode = "RGB"
-        mock_image_class.open.return_value = mock_image
+        # The image is only opened through the mocked Image class
+        fake_path = "/fake/invoice.png"
         
-        # Create a temporary test image file
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
-            temp_file.write(b"fake image data")
-            temp_path = temp_file.name
+        with patch('app.services.ocr_service.SURYA_AVAILABLE', True), \
+             patch.object(Path, 'exists', return_value=True):
+            result = await service.extract_text(fake_path)
         
-        try:
-            # Create service and test
-            service = OCRService()
-            result = await service.extract_text(temp_path)
-            
-            # Assertions
-            assert "Invoice #12345" in result
-            assert "Amount: $100.00" in result
-            mock_image_class.open.assert_called_once_with(Path(temp_path))
-            mock_model.extract_text.assert_called_once()
-            
-        finally:
-            # Cleanup
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+        # Assertions
+        assert result == "Invoice #12345\nAmount: $100.00"
+        mock_image_class.open.assert_called_once_with(fake_path)
+        service.recognition_predictor.assert_called_once_with(
+            [mock_image_class.open.return_value], det_predictor=None
+        )
     
-    @pytest.mark.asyncio
-    @patch('app.services.ocr_service.OCRModel')
-    async def test_extract_text_unsupported_format(self, mock_ocr_model_class):
+    async def test_extract_text_unsupported_format(self):
         """Test error handling for unsupported file formats"""
         from app.exceptions import FileProcessingError
         
-        # Create a temporary file with unsupported extension
-        with tempfile.NamedTemporaryFile(suffix='.txt', delete=False) as temp_file:
-            temp_file.write(b"plain text file")
-            temp_path = temp_file.name
-        
-        try:
+        # An existing file with an unsupported extension
+        with patch.object(Path, 'exists', return_value=True):
             service = OCRService()
             
             with pytest.raises(FileProcessingError, match="Unsupported file format"):
-                await service.extract_text(temp_path)
-                
-        finally:
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+                await service.extract_text("/fake/invoice.txt")
     
-    @pytest.mark.asyncio
-    @patch('app.services.ocr_service.OCRModel')
-    async def test_extract_text_file_not_found(self, mock_ocr_model_class):
+    async def test_extract_text_file_not_found(self):
         """Test error handling when file doesn't exist"""
         from app.exceptions import FileProcessingError
         
@@ -105,78 +90,226 @@ class TestOCRService:
         with pytest.raises(FileProcessingError, match="File not found"):
             await service.extract_text(non_existent_path)
     
-    @pytest.mark.asyncio
-    @patch('app.services.ocr_service.OCRModel')
+    @patch('app.services.ocr_service.PYMUPDF_AVAILABLE', True)
     @patch('app.services.ocr_service.fitz')
-    @patch('app.services.ocr_service.Image')
-    async def test_extract_from_pdf_success(self, mock_image_class, mock_fitz, mock_ocr_model_class):
+    async def test_extract_from_pdf_success(self, mock_fitz):
         """Test successful text extraction from PDF"""
-        # Setup mocks for PDF processing
+        # Setup mocks - a single-page PDF is read on the OCR thread, not the worker pool
         mock_doc = MagicMock()
-        mock_page = MagicMock()
-        mock_pix = MagicMock()
-        mock_pix.tobytes.return_value = b"fake png data"
-        
-        mock_page.get_pixmap.return_value = mock_pix
-        mock_doc.load_page.return_value = mock_page
         mock_doc.__len__.return_value = 1
+        mock_doc.load_page.return_value.get_text.return_value = "PDF content line 1\nPDF content line 2"
         mock_fitz.open.return_value = mock_doc
         
-        # Setup OCR model mock
-        mock_model = MagicMock()
-        mock_model.extract_text.return_value = [
-            [
-                MagicMock(text="PDF content line 1"),
-                MagicMock(text="PDF content line 2")
-            ]
-        ]
-        mock_ocr_model_class.return_value = mock_model
+        # The PDF is only opened through the mocked fitz module
+        fake_path = "/fake/invoice.pdf"
         
-        # Setup image mock
-        mock_image = MagicMock()
-        mock_image.mode = "RGB"
-        mock_image_class.open.return_value = mock_image
+        with patch.object(Path, 'exists', return_value=True):
+            service = OCRService()
+            result = await service.extract_text(fake_path)
         
-        # Create a temporary PDF file
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_file:
-            temp_file.write(b"fake pdf data")
-            temp_path = temp_file.name
+        # Assertions
+        assert result == "--- Page 1 ---\nPDF content line 1\nPDF content line 2"
+        mock_fitz.open.assert_called_once_with(Path(fake_path))
+        mock_doc.load_page.assert_called_once_with(0)
+    
+    async def test_extract_from_pdf_multi_page_concurrent(self):
+        """Test that multi-page PDFs are extracted in parallel and keep page order"""
+        fitz = pytest.importorskip("fitz")
+        from app.services.ocr_service import shutdown_page_executor
+        
+        doc = fitz.open()
+        for page_num in range(3):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Invoice page {page_num + 1}")
+        
+        fd, temp_path = tempfile.mkstemp(suffix='.pdf')
+        os.write(fd, doc.tobytes())
+        os.close(fd)
+        doc.close()
         
         try:
             service = OCRService()
             result = await service.extract_text(temp_path)
             
-            # Assertions
-            assert "--- Page 1 ---" in result
-            assert "PDF content line 1" in result
-            assert "PDF content line 2" in result
-            mock_fitz.open.assert_called_once_with(Path(temp_path))
+            assert result.index("--- Page 1 ---") < result.index("--- Page 2 ---") < result.index("--- Page 3 ---")
+            assert "Invoice page 1" in result
+            assert "Invoice page 3" in result
             
         finally:
+            shutdown_page_executor()
             if os.path.exists(temp_path):
                 os.unlink(temp_path)
+
+    async def test_extract_pages_split_into_worker_ranges(self):
+        """Test that pages are split into one contiguous range per worker"""
+        import asyncio
+        from app.services.ocr_service import _extract_page_range
+
+        service = OCRService()
+        loop_calls = []
+
+        async def fake_run_in_executor(executor, func, pdf_path, start, stop):
+            loop_calls.append((func, start, stop))
+            return [f"page {page_num}" for page_num in range(start, stop)]
+
+        loop = asyncio.get_running_loop()
+        with patch('app.services.ocr_service.settings') as mock_settings, \
+             patch('app.services.ocr_service._get_page_executor'), \
+             patch.object(loop, 'run_in_executor', fake_run_in_executor):
+            mock_settings.ocr_concurrency = 2
+
+            result = await service._extract_pages_concurrently(Path("invoice.pdf"), 5)
+
+        assert loop_calls == [(_extract_page_range, 0, 3), (_extract_page_range, 3, 5)]
+        assert result == [f"page {page_num}" for page_num in range(5)]
+
+    async def test_extract_from_pdf_batches_pages(self):
+        """Test that image-based PDF pages are OCR'd in a single batched predictor call"""
+        fitz = pytest.importorskip("fitz")
+        pil_image = pytest.importorskip("PIL.Image")
+        page_count = 8
+        
+        doc = fitz.open()
+        for _ in range(page_count):
+            doc.new_page(width=100, height=100)
+        
+        fd, temp_path = tempfile.mkstemp(suffix='.pdf')
+        os.write(fd, doc.tobytes())
+        os.close(fd)
+        doc.close()
+        
+        predictions = [
+            SimpleNamespace(text_lines=[TextLine(f"Page {page_num + 1} text")])
+            for page_num in range(page_count)
+        ]
+        
+        try:
+            with patch('app.services.ocr_service.Image', pil_image):
+                service = OCRService()
+                service.recognition_predictor = MagicMock(return_value=predictions)
+                
+                result = await service._extract_from_pdf(Path(temp_path))
+            
+            service.recognition_predictor.assert_called_once()
+            images = service.recognition_predictor.call_args[0][0]
+            assert len(images) == page_count
+            assert all(image.size == (200, 200) for image in images)
+            assert result == "\n\n".join(
+                f"--- Page {page_num + 1} ---\nPage {page_num + 1} text" for page_num in range(page_count)
+            )
+            
+        finally:
+            os.unlink(temp_path)
     
-    @pytest.mark.asyncio
-    @patch('app.services.ocr_service.get_ocr_service')
-    async def test_extract_text_convenience_function(self, mock_get_service):
+    async def test_extract_from_image_runs_on_ocr_thread(self):
+        """Test that Surya inference runs on the OCR worker thread, not the event loop"""
+        import io
+        import threading
+        pil_image = pytest.importorskip("PIL.Image")
+        
+        buffer = io.BytesIO()
+        pil_image.new("RGB", (10, 10)).save(buffer, format="PNG")
+        buffer.seek(0)
+        
+        call_threads = []
+        
+        def fake_predictor(images, det_predictor=None):
+            call_threads.append(threading.current_thread().name)
+            return [SimpleNamespace(text_lines=[TextLine("Invoice text")])]
+        
+        with patch('app.services.ocr_service.Image', pil_image):
+            service = OCRService()
+            service.recognition_predictor = fake_predictor
+            
+            result = await service._extract_from_image(buffer)
+        
+        assert result == "Invoice text"
+        assert call_threads[0].startswith("ocr")
+
+    def test_predictors_warmed_up_on_load(self):
+        """Test that loading the Surya predictors runs one warm-up inference"""
+        with patch('app.services.ocr_service.SURYA_AVAILABLE', True), \
+             patch('app.services.ocr_service.FoundationPredictor', create=True), \
+             patch('app.services.ocr_service.RecognitionPredictor', create=True) as mock_recognition, \
+             patch('app.services.ocr_service.DetectionPredictor', create=True) as mock_detection, \
+             patch('app.services.ocr_service.Image', create=True) as mock_image:
+            service = OCRService()
+
+        mock_image.new.assert_called_once_with("RGB", (64, 64), "white")
+        mock_recognition.return_value.assert_called_once_with(
+            [mock_image.new.return_value], det_predictor=mock_detection.return_value
+        )
+        assert service.recognition_predictor is mock_recognition.return_value
+
+    def test_predictor_warm_up_failure_is_not_fatal(self):
+        """Test that a failed warm-up keeps the loaded predictors"""
+        with patch('app.services.ocr_service.SURYA_AVAILABLE', True), \
+             patch('app.services.ocr_service.FoundationPredictor', create=True), \
+             patch('app.services.ocr_service.RecognitionPredictor', create=True) as mock_recognition, \
+             patch('app.services.ocr_service.DetectionPredictor', create=True), \
+             patch('app.services.ocr_service.Image', create=True):
+            mock_recognition.return_value.side_effect = RuntimeError("no device")
+            service = OCRService()
+
+        assert service.recognition_predictor is mock_recognition.return_value
+
+    async def test_extract_text_from_bytes_pdf(self):
+        """Test that PDF content is extracted from memory for single and multi-page documents"""
+        fitz = pytest.importorskip("fitz")
+        from app.services.ocr_service import shutdown_page_executor
+        
+        def build_pdf(page_count):
+            doc = fitz.open()
+            for page_num in range(page_count):
+                page = doc.new_page()
+                page.insert_text((72, 72), f"Invoice page {page_num + 1}")
+            data = doc.tobytes()
+            doc.close()
+            return data
+        
+        try:
+            service = OCRService()
+            
+            single = await service.extract_text_from_bytes(build_pdf(1), "application/pdf")
+            assert "Invoice page 1" in single
+            
+            multi = await service.extract_text_from_bytes(build_pdf(2), "application/pdf")
+            assert multi.index("--- Page 1 ---") < multi.index("--- Page 2 ---")
+            assert "Invoice page 2" in multi
+            
+        finally:
+            shutdown_page_executor()
+    
+    async def test_extract_text_from_bytes_unsupported_type(self):
+        """Test that unsupported content types are rejected"""
+        from app.exceptions import FileProcessingError
+        
+        service = OCRService()
+        
+        with pytest.raises(FileProcessingError, match="Unsupported content type"):
+            await service.extract_text_from_bytes(b"GIF89a", "image/gif")
+    
+    async def test_extract_text_convenience_function(self, monkeypatch):
         """Test the convenience extract_text function"""
-        mock_service = AsyncMock()
-        mock_service.extract_text.return_value = "Extracted text"
-        mock_get_service.return_value = mock_service
+        class StubOCRService:
+            """Records the paths passed to extract_text"""
+            def __init__(self):
+                self.called_with = []
+            
+            async def extract_text(self, file_path):
+                self.called_with.append(file_path)
+                return "Extracted text"
+        
+        stub_service = StubOCRService()
+        monkeypatch.setattr("app.services.ocr_service._ocr_service", stub_service)
         
         result = await extract_text("test_file.png")
         
         assert result == "Extracted text"
-        mock_service.extract_text.assert_called_once_with("test_file.png")
+        assert stub_service.called_with == ["test_file.png"]
     
-    @pytest.mark.asyncio
-    @patch('app.services.ocr_service.OCRModel')
-    async def test_get_ocr_service_singleton(self, mock_ocr_model_class):
+    async def test_get_ocr_service_singleton(self):
         """Test that get_ocr_service returns the same instance"""
-        # Clear any existing instance
-        import app.services.ocr_service
-        app.services.ocr_service._ocr_service = None
-        
         service1 = await get_ocr_service()
         service2 = await get_ocr_service()
         
@@ -187,27 +320,35 @@ class TestOCRService:
 class TestAIService:
     """Test cases for AI service"""
     
-    @pytest.fixture
+    @pytest.fixture(autouse=True)
     def mock_genai(self):
-        """Mock google.generativeai module"""
-        import google.generativeai as genai
+        """Mock google.generativeai module for every test - request it to customize responses"""
         mock_model = MagicMock()
-        mock_response = MagicMock()
-        mock_response.text = '{"invoice_number": "INV-12345", "vendor_name": "Test Vendor", "total": 100.50, "currency": "USD", "subtotal": 95.00, "tax": 5.50, "items": []}'
+        mock_response = SimpleNamespace(text=GEMINI_RESPONSE_TEXT)
         mock_model.generate_content.return_value = mock_response
         
         with patch('app.services.ai_service.genai') as mock_genai_module:
             mock_genai_module.GenerativeModel.return_value = mock_model
             yield mock_genai_module, mock_model, mock_response
     
+    @pytest.fixture(autouse=True)
+    def mock_response_cache(self):
+        """Mock the AI response cache - always a miss unless a test overrides it"""
+        with patch('app.services.ai_service.cache_service') as mock_cache:
+            mock_cache.get = AsyncMock(return_value=None)
+            mock_cache.set = AsyncMock(return_value=True)
+            mock_cache.delete = AsyncMock(return_value=True)
+            yield mock_cache
+    
     @pytest.fixture  
     def mock_settings(self):
         """Mock settings with valid API key"""
         with patch('app.services.ai_service.settings') as mock_settings:
             mock_settings.google_api_key = "test_api_key"
+            mock_settings.gemini_max_concurrency = 8
+            mock_settings.gemini_enable_batching = False
             yield mock_settings
     
-    @pytest.mark.asyncio
     async def test_ai_service_initialization_success(self, mock_settings, mock_genai):
         """Test successful AI service initialization"""
         from app.services.ai_service import AIService
@@ -218,6 +359,107 @@ class TestAIService:
         assert service.prompt_manager is not None
         assert service.circuit_breaker is not None
         mock_genai[0].configure.assert_called_once_with(api_key="test_api_key")
+        mock_genai[0].GenerativeModel.assert_called_once_with(
+            "gemini-2.5-pro",
+            generation_config={"response_mime_type": "application/json"}
+        )
+        
+    async def test_gemini_call_runs_off_event_loop_thread(self, mock_settings, mock_genai):
+        """Test that the blocking Gemini SDK call runs in a worker thread"""
+        import threading
+        from app.services.ai_service import AIService
+        
+        call_threads = []
+        mock_genai[1].generate_content.side_effect = lambda prompt: (
+            call_threads.append(threading.get_ident()) or mock_genai[2]
+        )
+        
+        service = AIService()
+        result = await service._call_gemini_api("test prompt")
+        
+        assert result == mock_genai[2].text
+        assert call_threads and call_threads[0] != threading.get_ident()
+        
+    async def test_gemini_calls_respect_concurrency_limit(self, mock_settings, mock_genai):
+        """Test that concurrent Gemini calls are capped by gemini_max_concurrency"""
+        import asyncio
+        import threading
+        import time
+        from app.services.ai_service import AIService
+        
+        mock_settings.gemini_max_concurrency = 2
+        lock = threading.Lock()
+        in_flight = {"current": 0, "peak": 0}
+        
+        def slow_generate_content(prompt):
+            with lock:
+                in_flight["current"] += 1
+                in_flight["peak"] = max(in_flight["peak"], in_flight["current"])
+            time.sleep(0.05)
+            with lock:
+                in_flight["current"] -= 1
+            return mock_genai[2]
+        
+        mock_genai[1].generate_content.side_effect = slow_generate_content
+        
+        service = AIService()
+        await asyncio.gather(*(service._call_gemini_api(f"prompt {i}") for i in range(5)))
+        
+        assert in_flight["peak"] == 2
+        
+    async def test_get_structured_data_respects_concurrency_limit(self, mock_settings, mock_genai):
+        """Test that a burst of extractions never exceeds gemini_max_concurrency in-flight calls"""
+        import asyncio
+        import threading
+        import time
+        from app.services.ai_service import AIService
+        
+        mock_settings.gemini_max_concurrency = 4
+        lock = threading.Lock()
+        in_flight = {"current": 0, "peak": 0}
+        
+        def slow_generate_content(prompt):
+            with lock:
+                in_flight["current"] += 1
+                in_flight["peak"] = max(in_flight["peak"], in_flight["current"])
+            time.sleep(0.05)
+            with lock:
+                in_flight["current"] -= 1
+            return mock_genai[2]
+        
+        mock_genai[1].generate_content.side_effect = slow_generate_content
+        
+        service = AIService()
+        results = await asyncio.gather(*(service.get_structured_data(f"Invoice {i}") for i in range(20)))
+        
+        assert all(result.invoice_number == "INV-12345" for result in results)
+        assert mock_genai[1].generate_content.call_count == 20
+        assert in_flight["peak"] == 4
+        
+    async def test_get_structured_data_backs_off_on_rate_limit(self, mock_settings, mock_genai):
+        """Test that rate-limit errors are retried after backoff waits without real sleeping"""
+        from app.services.ai_service import AIService
+        
+        mock_genai[1].generate_content.side_effect = [
+            Exception("429 Resource has been exhausted"),
+            Exception("rate limit exceeded"),
+            mock_genai[2],
+        ]
+        backoff_sleeps = []
+        
+        async def record_sleep(seconds):
+            backoff_sleeps.append(seconds)
+        
+        service = AIService()
+        with patch.object(AIService._call_gemini_api.retry, 'sleep', record_sleep):
+            result = await service.get_structured_data("Invoice #INV-12345")
+        
+        assert result.invoice_number == "INV-12345"
+        assert mock_genai[1].generate_content.call_count == 3
+        # Two full-jitter exponential waits, within the first two windows
+        assert len(backoff_sleeps) == 2
+        assert 0 <= backoff_sleeps[0] <= 2
+        assert 0 <= backoff_sleeps[1] <= 4
         
     def test_ai_service_initialization_no_api_key(self):
         """Test AI service initialization fails without API key"""
@@ -227,10 +469,21 @@ class TestAIService:
         with patch('app.services.ai_service.settings') as mock_settings:
             mock_settings.google_api_key = ""
             
-            with pytest.raises(AiServiceError, match="Google API key not configured"):
+            with pytest.raises(AiServiceError, match=NO_API_KEY_RE):
                 AIService()
-    
-    @pytest.mark.asyncio
+
+    def test_get_ai_service_configures_sdk_once(self, mock_settings, mock_genai):
+        """Test that repeated get_ai_service calls reuse one client and configure the SDK once"""
+        from app.services import ai_service as ai_service_module
+
+        with patch.object(ai_service_module, 'ai_service', None):
+            first = ai_service_module.get_ai_service()
+            second = ai_service_module.get_ai_service()
+
+        assert first is second
+        mock_genai[0].configure.assert_called_once_with(api_key="test_api_key")
+        mock_genai[0].GenerativeModel.assert_called_once()
+
     async def test_get_structured_data_success(self, mock_settings, mock_genai):
         """Test successful structured data extraction"""
         from app.services.ai_service import AIService
@@ -255,7 +508,52 @@ class TestAIService:
         call_args = mock_genai[1].generate_content.call_args[0][0]
         assert test_text in call_args
         
-    @pytest.mark.asyncio
+    async def test_get_structured_data_caches_result(self, mock_settings, mock_genai, mock_response_cache):
+        """Test that validated results are cached under a content-addressed key"""
+        from app.services.ai_service import AIService
+        
+        service = AIService()
+        await service.get_structured_data("Invoice #INV-12345")
+        
+        cache_key, cached_value = mock_response_cache.set.call_args[0]
+        assert cache_key.startswith("inv:")
+        assert cached_value["invoice_number"] == "INV-12345"
+        
+        # Same text maps to the same key, different text to a different one
+        assert cache_key == service._response_cache_key("inv", "Invoice #INV-12345")
+        assert cache_key != service._response_cache_key("inv", "Invoice #INV-99999")
+    
+    async def test_get_structured_data_cache_hit(self, mock_settings, mock_genai, mock_response_cache):
+        """Test that a cached result is returned without calling Gemini"""
+        from app.services.ai_service import AIService
+        
+        mock_response_cache.get.return_value = {
+            "invoice_number": "INV-CACHED",
+            "vendor_name": "Cached Vendor",
+            "subtotal": 10.0,
+            "tax": 1.0,
+            "total": 11.0
+        }
+        
+        service = AIService()
+        result = await service.get_structured_data("Invoice text")
+        
+        assert result.invoice_number == "INV-CACHED"
+        mock_genai[1].generate_content.assert_not_called()
+    
+    async def test_get_structured_data_evicts_invalid_cache_entry(self, mock_settings, mock_genai, mock_response_cache):
+        """Test that a cached entry failing validation is evicted and re-extracted"""
+        from app.services.ai_service import AIService
+        
+        mock_response_cache.get.return_value = {"invoice_number": "INV-OLD"}
+        
+        service = AIService()
+        result = await service.get_structured_data("Invoice text")
+        
+        assert result.invoice_number == "INV-12345"
+        mock_response_cache.delete.assert_awaited_once()
+        mock_genai[1].generate_content.assert_called_once()
+    
     async def test_get_structured_data_with_table_data(self, mock_settings, mock_genai):
         """Test structured data extraction with table data"""
         from app.services.ai_service import AIService
@@ -275,7 +573,6 @@ class TestAIService:
         assert "Table 1:" in call_args
         assert "Item 1 | $10.00" in call_args
     
-    @pytest.mark.asyncio
     async def test_get_structured_data_empty_text(self, mock_settings, mock_genai):
         """Test error handling for empty text input"""
         from app.services.ai_service import AIService
@@ -283,69 +580,61 @@ class TestAIService:
         
         service = AIService()
         
-        with pytest.raises(AiServiceError, match="Empty or invalid invoice text provided"):
+        with pytest.raises(AiServiceError, match=EMPTY_TEXT_RE):
             await service.get_structured_data("")
             
-        with pytest.raises(AiServiceError, match="Empty or invalid invoice text provided"):
+        with pytest.raises(AiServiceError, match=EMPTY_TEXT_RE):
             await service.get_structured_data("   ")
     
-    @pytest.mark.asyncio
-    async def test_get_structured_data_invalid_json_response(self, mock_settings):
+    async def test_get_structured_data_invalid_json_response(self, mock_settings, mock_genai):
         """Test error handling for invalid JSON response from AI"""
         from app.services.ai_service import AIService
         from app.exceptions import AiServiceError
         
         # Mock AI to return invalid JSON
-        mock_model = MagicMock()
-        mock_response = MagicMock()
-        mock_response.text = "This is not valid JSON"
-        mock_model.generate_content.return_value = mock_response
+        mock_genai[2].text = "This is not valid JSON"
+        service = AIService()
         
-        with patch('app.services.ai_service.genai') as mock_genai_module:
-            mock_genai_module.GenerativeModel.return_value = mock_model
-            
-            service = AIService()
-            
-            with pytest.raises(AiServiceError, match="Failed to parse structured data from AI response"):
-                await service.get_structured_data("Test invoice text")
+        with pytest.raises(AiServiceError, match=PARSE_FAILED_RE):
+            await service.get_structured_data("Test invoice text")
     
-    @pytest.mark.asyncio
-    async def test_get_structured_data_validation_error(self, mock_settings):
+    async def test_get_structured_data_validation_error(self, mock_settings, mock_genai):
         """Test error handling for data validation errors"""
         from app.services.ai_service import AIService
         from app.exceptions import AiServiceError
         
         # Mock AI to return JSON that fails validation
-        mock_model = MagicMock()
-        mock_response = MagicMock()
-        mock_response.text = '{"invoice_number": "INV-123", "total": "invalid_number"}'  # Invalid total
-        mock_model.generate_content.return_value = mock_response
+        mock_genai[2].text = '{"invoice_number": "INV-123", "total": "invalid_number"}'  # Invalid total
+        service = AIService()
         
-        with patch('app.services.ai_service.genai') as mock_genai_module:
-            mock_genai_module.GenerativeModel.return_value = mock_model
-            
-            service = AIService()
-            
-            with pytest.raises(AiServiceError, match="AI response data failed validation"):
-                await service.get_structured_data("Test invoice text")
-    
-    @pytest.mark.asyncio
-    async def test_get_structured_data_api_error(self, mock_settings):
+        with pytest.raises(AiServiceError, match=VALIDATION_FAILED_RE):
+            await service.get_structured_data("Test invoice text")
+
+    async def test_get_structured_data_non_object_json(self, mock_settings, mock_genai):
+        """Test that valid JSON of the wrong shape is reported as a validation error"""
+        from app.services.ai_service import AIService
+        from app.exceptions import AiServiceError
+
+        mock_genai[2].text = '[{"invoice_number": "INV-123"}]'
+        service = AIService()
+
+        with pytest.raises(AiServiceError, match=VALIDATION_FAILED_RE):
+            await service.get_structured_data("Test invoice text")
+
+    async def test_get_structured_data_api_error(self, mock_settings, mock_genai):
         """Test error handling for API errors"""
         from app.services.ai_service import AIService
         from app.exceptions import AiServiceError
         
-        # Mock AI to raise an exception
-        mock_model = MagicMock()
-        mock_model.generate_content.side_effect = Exception("API connection error")
+        # Mock AI to raise a transient exception on every attempt
+        mock_genai[1].generate_content.side_effect = Exception("API connection error")
+        service = AIService()
         
-        with patch('app.services.ai_service.genai') as mock_genai_module:
-            mock_genai_module.GenerativeModel.return_value = mock_model
-            
-            service = AIService()
-            
-            with pytest.raises(AiServiceError):
-                await service.get_structured_data("Test invoice text")
+        with patch.object(AIService._call_gemini_api.retry, 'wait', wait_none()), \
+             pytest.raises(AiServiceError):
+            await service.get_structured_data("Test invoice text")
+        
+        assert mock_genai[1].generate_content.call_count == 6
     
     def test_fallback_placeholders(self, mock_settings, mock_genai):
         """Test that fallback placeholders are implemented"""
@@ -358,25 +647,100 @@ class TestAIService:
             
         with pytest.raises(NotImplementedError, match="Claude fallback not implemented yet"):
             service._fallback_to_claude("test text")
+    
+    async def test_batching_coalesces_concurrent_extractions(self, mock_settings, mock_genai):
+        """Test that concurrent extractions share one batched Gemini call"""
+        import asyncio
+        from app.services.ai_service import AIService
+        
+        mock_settings.gemini_enable_batching = True
+        mock_settings.gemini_batch_size = 8
+        mock_settings.gemini_batch_window_ms = 50
+        mock_genai[2].text = (
+            '[{"id": "1", "invoice": {"invoice_number": "INV-2", "vendor_name": "V", "subtotal": 1.0, "tax": 0.0, "total": 1.0}},'
+            ' {"id": "0", "invoice": {"invoice_number": "INV-1", "vendor_name": "V", "subtotal": 1.0, "tax": 0.0, "total": 1.0}}]'
+        )
+        
+        service = AIService()
+        first, second = await asyncio.gather(
+            service.get_structured_data("Invoice #INV-1"),
+            service.get_structured_data("Invoice #INV-2"),
+        )
+        
+        assert first.invoice_number == "INV-1"
+        assert second.invoice_number == "INV-2"
+        mock_genai[1].generate_content.assert_called_once()
+        prompt = mock_genai[1].generate_content.call_args[0][0]
+        assert "Invoice #INV-1" in prompt and "Invoice #INV-2" in prompt
+        await service.close()
+    
+    async def test_batching_single_request_uses_regular_prompt(self, mock_settings, mock_genai):
+        """Test that a lone request in the batch window is sent with the normal prompt"""
+        from app.services.ai_service import AIService
+        
+        mock_settings.gemini_enable_batching = True
+        mock_settings.gemini_batch_size = 8
+        mock_settings.gemini_batch_window_ms = 1
+        
+        service = AIService()
+        result = await service.get_structured_data("Invoice #INV-12345")
+        
+        assert result.invoice_number == "INV-12345"
+        prompt = mock_genai[1].generate_content.call_args[0][0]
+        assert prompt == service.prompt_manager.get_extraction_prompt("Invoice #INV-12345")
+        await service.close()
+    
+    async def test_batching_missing_invoice_raises(self, mock_settings, mock_genai):
+        """Test that an invoice absent from the batched response fails only that request"""
+        import asyncio
+        from app.services.ai_service import AIService
+        from app.exceptions import AiServiceError
+        
+        mock_settings.gemini_enable_batching = True
+        mock_settings.gemini_batch_size = 8
+        mock_settings.gemini_batch_window_ms = 50
+        mock_genai[2].text = '[{"id": "0", "invoice": {"invoice_number": "INV-1", "vendor_name": "V", "subtotal": 1.0, "tax": 0.0, "total": 1.0}}]'
+        
+        service = AIService()
+        first, second = await asyncio.gather(
+            service.get_structured_data("Invoice #INV-1"),
+            service.get_structured_data("Invoice #INV-2"),
+            return_exceptions=True
+        )
+        
+        assert first.invoice_number == "INV-1"
+        assert isinstance(second, AiServiceError)
+        await service.close()
+    
+    def test_clean_ai_response_markdown_fences(self):
+        """Test that markdown code fences are stripped from AI responses"""
+        from app.services.ai_service import clean_ai_response
+        
+        assert clean_ai_response('  {"a": 1}  ') == '{"a": 1}'
+        assert clean_ai_response('```json\n{"a": 1}\n```') == '{"a": 1}'
+        assert clean_ai_response('```\n{"a": 1}\n```') == '{"a": 1}'
+        assert clean_ai_response('Here you go:\n```json\n{"a": 1}\n```\nDone') == '{"a": 1}'
+        # An unterminated fence is left as-is
+        assert clean_ai_response('```json {"a": 1}') == '```json {"a": 1}'
 
 
 class TestPromptManager:
     """Test cases for PromptManager"""
     
-    def test_prompt_manager_initialization(self):
-        """Test PromptManager initializes correctly"""
+    @pytest.fixture(scope="class")
+    def manager(self):
+        """PromptManager shared by the class - prompt generation is stateless"""
         from app.prompts.invoice_prompts import PromptManager
-        
-        manager = PromptManager()
+        return PromptManager()
+    
+    def test_prompt_manager_initialization(self, manager):
+        """Test PromptManager initializes correctly"""
         assert manager.base_template is not None
         assert "invoice_text" in manager.base_template
         assert "Response (valid JSON only)" in manager.base_template
     
-    def test_get_extraction_prompt_basic(self):
+    def test_get_extraction_prompt_basic(self, manager):
         """Test basic prompt generation"""
-        from app.prompts.invoice_prompts import PromptManager
-        
-        manager = PromptManager()
         invoice_text = "Invoice #12345\nVendor: Test Company\nTotal: $100.00"
         
         prompt = manager.get_extraction_prompt(invoice_text)
@@ -387,11 +751,8 @@ class TestPromptManager:
         assert "total" in prompt
         assert "Response (valid JSON only)" in prompt
     
-    def test_get_extraction_prompt_with_table_data(self):
+    def test_get_extraction_prompt_with_table_data(self, manager):
         """Test prompt generation with table data"""
-        from app.prompts.invoice_prompts import PromptManager
-        
-        manager = PromptManager()
         invoice_text = "Invoice #12345"
         table_data = {
             "tables": [
@@ -409,11 +770,8 @@ class TestPromptManager:
         assert "Widget | 2 | $10.00" in prompt
         assert "Consulting | 5 | $50.00" in prompt
     
-    def test_get_extraction_prompt_empty_table_data(self):
+    def test_get_extraction_prompt_empty_table_data(self, manager):
         """Test prompt generation with empty table data"""
-        from app.prompts.invoice_prompts import PromptManager
-        
-        manager = PromptManager()
         invoice_text = "Invoice #12345"
         table_data = {}
         
@@ -422,14 +780,28 @@ class TestPromptManager:
         assert invoice_text in prompt
         assert "Table Data:" not in prompt
     
-    def test_get_extraction_prompt_no_table_data(self):
+    def test_get_extraction_prompt_no_table_data(self, manager):
         """Test prompt generation with None table data"""
-        from app.prompts.invoice_prompts import PromptManager
-        
-        manager = PromptManager()
         invoice_text = "Invoice #12345"
         
         prompt = manager.get_extraction_prompt(invoice_text, None)
         
         assert invoice_text in prompt
-        assert "Table Data:" not in prompt
\ No newline at end of file
+        assert "Table Data:" not in prompt
+    
+    def test_get_batch_extraction_prompt(self, manager):
+        """Test batched prompt embeds every invoice with its id"""
+        import json
+        
+        prompt = manager.get_batch_extraction_prompt([
+            ("0", "Invoice #1", None),
+            ("1", "Invoice #2", {"tables": ["Item | Qty"]}),
+        ])
+        
+        invoices = json.loads(prompt.split("Invoices:\n", 1)[1].split("\n", 1)[0])
+        assert invoices == [
+            {"id": "0", "text": "Invoice #1"},
+            {"id": "1", "text": "Invoice #2", "tables": ["Item | Qty"]},
+        ]
+        assert "invoice_number" in prompt
+        assert "Response (valid JSON only)" in prompt
@@ -0,0 +1,53 @@
+"""Micro-benchmarks for parsing Gemini invoice responses"""
+
+import json
+
+import orjson
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+# Deselected by default (see addopts in pyproject.toml); run with -m bench
+pytestmark = pytest.mark.bench
+
+from app.schemas import InvoiceData
+
+# Realistic ~4KB Gemini reply: header fields plus a few dozen line items
+INVOICE_RESPONSE = orjson.dumps({
+    "invoice_number": "INV-2024-000123",
+    "invoice_date": "2024-03-15",
+    "due_date": "2024-04-14",
+    "vendor_name": "Acme Industrial Supplies Ltd.",
+    "vendor_address": "1200 Commerce Park Drive, Suite 400, Springfield, IL 62704",
+    "customer_name": "Northwind Manufacturing",
+    "customer_address": "77 Harbor Road, Portsmouth, NH 03801",
+    "subtotal": 3975.0,
+    "tax": 318.0,
+    "total": 4293.0,
+    "currency": "USD",
+    "items": [
+        {
+            "description": f"Stainless steel hex bolt M{8 + item % 6} x {20 + item}mm, box of 100",
+            "quantity": float(item + 1),
+            "unit_price": 7.5,
+            "total_price": 7.5 * (item + 1),
+        }
+        for item in range(30)
+    ],
+}).decode()
+
+
+@pytest.mark.parametrize("loads", [json.loads, orjson.loads], ids=["json", "orjson"])
+def test_parse_invoice_response(benchmark, loads):
+    """Benchmark decoding a Gemini invoice response to a dict"""
+    result = benchmark(loads, INVOICE_RESPONSE)
+
+    assert result["invoice_number"] == "INV-2024-000123"
+    assert len(result["items"]) == 30
+
+
+def test_validate_invoice_response(benchmark):
+    """Benchmark the parse-and-validate path used by get_structured_data"""
+    result = benchmark(InvoiceData.model_validate_json, INVOICE_RESPONSE)
+
+    assert result.total == 4293.0
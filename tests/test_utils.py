@@ -1,105 +1,127 @@
 """Tests for utility functions"""
 
 import hashlib
+import io
+import os
+import tempfile
 import pytest
 
-from app.utils import calculate_file_hash
+from app.utils import calculate_file_hash, calculate_file_hash_stream, new_file_hasher, safe_unlink
+
+# 1MB zero-filled buffer allocated once; the large-content tests hash prefixes of it
+LARGE_BLOB = bytes(1 << 20)
 
 
 class TestUtils:
     """Test cases for utility functions"""
     
-    def test_calculate_file_hash_simple(self):
-        """Test hash calculation with simple content"""
-        # Setup
-        content = b"Hello, World!"
-        expected_hash = hashlib.sha256(content).hexdigest()
-        
-        # Execute
+    @pytest.mark.parametrize("content,expected_hash", [
+        (b"", "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"),
+        (b"Hello, World!", "dffd6021bb2bd5b0af676290809ec3a53191dd81c7f70a4b28688a362182986f"),
+        # Binary content - simulates a PDF header (%PDF-1.4)
+        (bytes([0x25, 0x50, 0x44, 0x46, 0x2D, 0x31, 0x2E, 0x34]),
+         "e16fa5d9b51928755db85b917f0297babaf22c7a47e97d9212adab56e61ba04e"),
+        # Special characters and unicode - UTF-8 of "Special characters: äöü ñ 中文 🚀"
+        (b"Special characters: \xc3\xa4\xc3\xb6\xc3\xbc \xc3\xb1 \xe4\xb8\xad\xe6\x96\x87 \xf0\x9f\x9a\x80",
+         "adeb5f9b8be2a15028a28dcbcea555ead2677d4eb39ed4327bebae9b6cc910a7"),
+        # Prefixes of the shared zero-filled buffer, up to 1MB
+        (LARGE_BLOB[:1 << 10], "5f70bf18a086007016e948b04aed3b82103a36bea41755b6cddfaf10ace3c6ef"),
+        (LARGE_BLOB[:1 << 16], "de2f256064a0af797747c2b97505dc0b9f3df0de4f489eac731c23ae9ca9cc31"),
+        (LARGE_BLOB, "30e14955ebf1352266dc2ff8067e68104607e750abb9d3b36582b8af909fcb58"),
+    ], ids=["empty", "simple", "binary", "special-characters", "1kb", "64kb", "1mb"])
+    def test_calculate_file_hash_known_digests(self, content, expected_hash):
+        """Test hash calculation against precomputed SHA-256 digests"""
         result = calculate_file_hash(content)
         
-        # Assert
         assert result == expected_hash
         assert len(result) == 64  # SHA-256 produces 64 character hex string
     
-    def test_calculate_file_hash_empty_file(self):
-        """Test hash calculation with empty file"""
-        # Setup
-        content = b""
-        expected_hash = hashlib.sha256(content).hexdigest()
-        
-        # Execute
-        result = calculate_file_hash(content)
-        
-        # Assert
-        assert result == expected_hash
-        assert result == "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
-    
-    def test_calculate_file_hash_binary_content(self):
-        """Test hash calculation with binary content"""
-        # Setup - simulate PDF/image binary content
-        content = bytes([0x25, 0x50, 0x44, 0x46, 0x2D, 0x31, 0x2E, 0x34])  # %PDF-1.4
-        expected_hash = hashlib.sha256(content).hexdigest()
-        
-        # Execute
-        result = calculate_file_hash(content)
+    @pytest.mark.parametrize("algorithm,hasher", [
+        ("sha256", hashlib.sha256),
+        ("blake2b", lambda data: hashlib.blake2b(data, digest_size=32)),
+    ])
+    def test_calculate_file_hash_matches_hashlib(self, algorithm, hasher):
+        """Test that the hash matches hashlib for arbitrary content"""
+        content = os.urandom(4096)
         
-        # Assert
-        assert result == expected_hash
-        assert len(result) == 64
+        assert calculate_file_hash(content, algorithm) == hasher(content).hexdigest()
     
-    def test_calculate_file_hash_large_content(self):
-        """Test hash calculation with large content"""
-        # Setup - 1MB of data
-        content = b"A" * (1024 * 1024)
-        expected_hash = hashlib.sha256(content).hexdigest()
-        
-        # Execute
-        result = calculate_file_hash(content)
-        
-        # Assert
-        assert result == expected_hash
-        assert len(result) == 64
-    
-    def test_calculate_file_hash_consistency(self):
+    @pytest.mark.parametrize("algorithm", ["sha256", "blake2b"])
+    def test_calculate_file_hash_consistency(self, algorithm):
         """Test that same content produces same hash"""
         # Setup
         content = b"Test content for consistency"
         
         # Execute
-        hash1 = calculate_file_hash(content)
-        hash2 = calculate_file_hash(content)
+        hash1 = calculate_file_hash(content, algorithm)
+        hash2 = calculate_file_hash(content, algorithm)
         
         # Assert
         assert hash1 == hash2
     
-    def test_calculate_file_hash_different_content(self):
+    @pytest.mark.parametrize("algorithm", ["sha256", "blake2b"])
+    def test_calculate_file_hash_different_content(self, algorithm):
         """Test that different content produces different hashes"""
         # Setup
         content1 = b"First content"
         content2 = b"Second content"
         
         # Execute
-        hash1 = calculate_file_hash(content1)
-        hash2 = calculate_file_hash(content2)
+        hash1 = calculate_file_hash(content1, algorithm)
+        hash2 = calculate_file_hash(content2, algorithm)
         
         # Assert
         assert hash1 != hash2
         assert len(hash1) == 64
         assert len(hash2) == 64
     
-    def test_calculate_file_hash_special_characters(self):
-        """Test hash calculation with special characters and unicode"""
+    def test_calculate_file_hash_file_object(self):
+        """Test hash calculation from an open binary file"""
         # Setup
-        content = "Special characters: äöü ñ 中文 🚀".encode('utf-8')
-        expected_hash = hashlib.sha256(content).hexdigest()
+        content = b"%PDF-1.4 " * 4096
+        expected_hash = "d601c1b08db98ebb4a06765faa58b942944ec97f100b9f81f4eaaa7724f110ab"
         
-        # Execute
-        result = calculate_file_hash(content)
+        with tempfile.TemporaryFile() as temp_file:
+            temp_file.write(content)
+            
+            # Execute - hashing starts from the beginning regardless of position
+            result = calculate_file_hash(temp_file)
         
         # Assert
         assert result == expected_hash
-        assert len(result) == 64
+    
+    @pytest.mark.parametrize("algorithm", ["sha256", "blake2b"])
+    def test_calculate_file_hash_stream(self, algorithm):
+        """Test chunked hashing of a read-only stream matches the one-shot hash"""
+        content = b"0123456789abcdef" * 10000
+        
+        class ReadOnlyStream:
+            """Non-seekable stream exposing only read()"""
+            def __init__(self, data):
+                self._buffer = io.BytesIO(data)
+            
+            def read(self, size=-1):
+                return self._buffer.read(size)
+        
+        result = calculate_file_hash_stream(ReadOnlyStream(content), chunk_size=4096, algorithm=algorithm)
+        
+        assert result == calculate_file_hash(content, algorithm)
+    
+    @pytest.mark.parametrize("algorithm", ["sha256", "blake2b"])
+    def test_new_file_hasher_matches_one_shot_hash(self, algorithm):
+        """Test that feeding chunks to new_file_hasher matches calculate_file_hash"""
+        content = b"%PDF-1.4 " * 4096
+        
+        hasher = new_file_hasher(algorithm)
+        for start in range(0, len(content), 4096):
+            hasher.update(content[start:start + 4096])
+        
+        assert hasher.hexdigest() == calculate_file_hash(content, algorithm)
+    
+    def test_calculate_file_hash_unsupported_algorithm(self):
+        """Test error handling for an unknown hash algorithm"""
+        with pytest.raises(ValueError, match="Unsupported hash algorithm: md5"):
+            calculate_file_hash(b"content", "md5")
     
     def test_calculate_file_hash_none_input(self):
         """Test error handling for None input"""
@@ -112,4 +134,18 @@ class TestUtils:
             calculate_file_hash("not bytes")
         
         with pytest.raises(ValueError, match="file_content must be bytes"):
-            calculate_file_hash(123)
\ No newline at end of file
+            calculate_file_hash(123)
+    
+    def test_safe_unlink_removes_file(self):
+        """Test that safe_unlink deletes an existing file"""
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)
+        
+        safe_unlink(temp_path)
+        
+        assert not os.path.exists(temp_path)
+    
+    def test_safe_unlink_missing_file(self):
+        """Test that missing files and None are ignored"""
+        safe_unlink("/nonexistent/path/to/file.pdf")
+        safe_unlink(None)